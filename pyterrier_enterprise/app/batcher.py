@@ -0,0 +1,127 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import pandas as pd
+
+class Overloaded(Exception):
+    """Raised by MicroBatcher.submit when the pending queue is full."""
+
+class MicroBatcher:
+    """Coalesce concurrent queries into one retriever.transform call.
+
+    The first query to arrive opens a batch. Any others that arrive within
+    max_wait_ms are added to it, up to max_batch queries. The batch then runs
+    as a single topics frame on one worker thread, so JVM calls stay
+    serialized, and each waiter gets back only its own rows. Each query
+    carries the retriever it was submitted with, so a batch that spans an
+    index reload runs every query against the index its request started on. Queries that
+    arrive while a batch is running wait for the next batch. If a batch
+    raises, its queries are retried one by one, so only the failing query's
+    waiter gets the exception.
+    """
+
+    def __init__(self, run_batch: Callable[[pd.DataFrame, Any], pd.DataFrame],
+                 max_batch: int = 32, max_wait_ms: float = 5.0, max_queue: int = 1024):
+        self._run = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieve")
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.queries = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pool.shutdown(wait=False)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, query: str, retriever: Any) -> pd.DataFrame:
+        """Retrieve one query with `retriever`; raises Overloaded if the queue is full."""
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((query, retriever, fut))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded()
+        return await fut
+
+    async def run_frame(self, topics: pd.DataFrame, retriever: Any) -> pd.DataFrame:
+        """Run a caller-built topics frame on the retrieval thread, bypassing
+        the queue (it's already a batch) but still serialized with it."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._run, topics, retriever)
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self) -> None:
+        while True:
+            batch = await self._collect()
+            # drop waiters that already went away (client disconnects)
+            batch = [item for item in batch if not item[2].done()]
+            # normally one group; two only while an index reload is in flight
+            groups: dict[int, list] = {}
+            for item in batch:
+                groups.setdefault(id(item[1]), []).append(item)
+            for group in groups.values():
+                await self._run_group(group)
+
+    async def _run_group(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        topics = pd.DataFrame({"qid": [str(i) for i in range(len(batch))],
+                               "query": [q for q, _, _ in batch]})
+        try:
+            res = await loop.run_in_executor(self._pool, self._run, topics, batch[0][1])
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][2].done():
+                    batch[0][2].set_exception(e)
+            else:
+                # one bad query mustn't fail its batch-mates: retry each alone
+                for item in batch:
+                    if not item[2].done():
+                        await self._run_group([item])
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        groups = {qid: g for qid, g in res.groupby("qid", sort=False)}
+        empty = res.iloc[0:0]
+        for i, (_, _, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(groups.get(str(i), empty))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "rejected": self.rejected,
+            "queue_depth": self.queue_depth(),
+            "avg_batch": (self.queries / self.batches) if self.batches else 0.0,
+        }
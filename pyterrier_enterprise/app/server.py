@@ -1,10 +1,26 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 from typing import Optional
+import asyncio
+import json
 from pathlib import Path
+import threading
+import time
+import pandas as pd
 import pyterrier as pt
 
 from src.config import settings
+from src.metrics import SEARCH_SECONDS, RETRIEVE_SECONDS, RETRIEVE_BATCH, META_SECONDS, ENCODE_SECONDS, SNIPPET_SECONDS
+from src.npindex import export_stamp
+from src.npsearch import NpHandle
+from src.queries import canon_query, clean_query
+from src.retrieval import IndexHandle, LOAD_MODES, index_stamp
+from app.batcher import MicroBatcher, Overloaded
+from app.result_cache import ResultCache
 
 app = FastAPI(title="PyTerrier BM25 API", version="1.0.0")
 
@@ -18,66 +34,323 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Lazy init
+# Initialised at startup (or lazily on first request if PRELOAD_INDEX=0)
 _pt_ready = False
-_index = None
-_br = None
+_init_lock = threading.Lock()
+_ready_info: dict = {}
+_live = None  # (index handle, retriever); replaced as one on reload
+_batcher = None
+_cache = ResultCache(settings.result_cache_size, settings.result_cache_ttl_s)
+_reload_lock = threading.Lock()
+_last_index_check = 0.0
 
-def ensure_pyterrier():
-    global _pt_ready, _index, _br
-    if _pt_ready:
-        return
-    # Heap + init
-    pt.java.set_memory_limit(2048)
-    pt.java.init()
+def _numpy_engine() -> bool:
+    return settings.search_engine == "numpy"
+
+def _current_stamp() -> tuple:
+    # the numpy engine serves the export, so only a new export means a reload
+    return export_stamp(settings.index_dir) if _numpy_engine() else index_stamp(settings.index_dir)
+
+def _snapshot() -> tuple:
+    """The (handle, retriever) pair a request should use from start to finish,
+    so a reload mid-request can't mix hits of one index with fields of another."""
+    return _live
 
-    # Open index
+def _open_index():
+    global _live
     index_path = Path(settings.index_dir)
     if not index_path.exists():
         raise RuntimeError(f"Index not found at {index_path}. Run `python -m src.build_index` first.")
-    _index = pt.IndexFactory.of(str(index_path))
-    _br = pt.BatchRetrieve(_index, wmodel="BM25")
-    _pt_ready = True
+    opts = dict(wmodel="BM25", k=100, agg=settings.passage_agg, passage_depth=settings.passage_depth)
+    if _numpy_engine():
+        # memory-mapped export only: no JVM, pages shared by all workers
+        handle = NpHandle(index_path, cache_mb=settings.npindex_cache_mb)
+        handle.term_pipeline()  # a missing stemmer fails the load, not the first query
+        br = handle.retriever(pruning=settings.search_pruning or None, **opts)
+        _live = (handle, br)
+        return
+    # base index plus any incremental deltas, minus superseded/deleted docs
+    handle = IndexHandle(index_path, memory=LOAD_MODES.get(settings.index_load_mode, False))
+    try:
+        br = handle.retriever(pruning=settings.search_pruning or None, **opts)
+    except RuntimeError as e:
+        # stale/missing export (e.g. right after a delta build): serve exhaustively
+        print(f"Pruned retrieval unavailable, using Terrier: {e}", flush=True)
+        br = handle.retriever(**opts)
+    _live = (handle, br)
+
+def ensure_pyterrier():
+    global _pt_ready
+    if _pt_ready:
+        return
+    with _init_lock:
+        if _pt_ready:
+            return
+        t0 = time.perf_counter()
+        # Heap + init (the numpy engine never starts Java)
+        if not _numpy_engine() and not pt.java.started():
+            pt.java.set_memory_limit(settings.server_heap_mb)
+            pt.java.init()
+
+        # Open index
+        _open_index()
+        _ready_info["load_s"] = round(time.perf_counter() - t0, 3)
+        _ready_info["load_mode"] = settings.index_load_mode
+        _ready_info["engine"] = settings.search_engine
+        _pt_ready = True
+
+def _warmup_topics() -> pd.DataFrame:
+    p = Path(settings.warmup_topics) if settings.warmup_topics else None
+    if p is None or not p.exists() or settings.warmup_count <= 0:
+        return pd.DataFrame(columns=["qid", "query"])
+    df = pd.read_csv(p, sep="\t", header=None, names=["qid", "query"], dtype=str,
+                     nrows=settings.warmup_count * 4)
+    df["query"] = df["query"].map(clean_query)
+    return df[df["query"] != ""].head(settings.warmup_count).reset_index(drop=True)
+
+def warm_start():
+    """Start Java (unless SEARCH_ENGINE=numpy), open the index and push a few
+    queries through it so the JIT, lexicon and posting pages are hot before
+    /ready says yes."""
+    try:
+        ensure_pyterrier()
+    except Exception as e:
+        _ready_info["error"] = str(e)
+        print(f"Index load failed: {e}", flush=True)
+        return
+    t0 = time.perf_counter()
+    topics = _warmup_topics()
+    if len(topics):
+        try:
+            handle, br = _snapshot()
+            res = br.transform(topics)
+            handle.fetch_fields(res["docid"].to_numpy()[:100], ["title"])
+        except Exception as e:
+            print(f"Warm-up failed (serving anyway): {e}", flush=True)
+    _ready_info["warmup_queries"] = len(topics)
+    _ready_info["warmup_s"] = round(time.perf_counter() - t0, 3)
+
+_warm_task = None
+
+@app.on_event("startup")
+async def _startup():
+    # in the background, so /health answers (and /ready says 503) while loading
+    global _warm_task
+    if settings.preload_index:
+        _warm_task = asyncio.get_running_loop().run_in_executor(None, warm_start)
+
+def maybe_reload_index():
+    """Reopen the index and drop cached results if a build/compaction changed it."""
+    global _last_index_check
+    now = time.monotonic()
+    if now - _last_index_check < settings.index_check_interval_s:
+        return
+    _last_index_check = now
+    if _current_stamp() == _snapshot()[0].stamp:
+        return
+    if not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        _open_index()
+        _cache.invalidate()
+    except Exception as e:
+        # e.g. caught mid-rebuild; keep serving the open index and retry next interval
+        print(f"Index reload failed, keeping the current one: {e}", flush=True)
+    finally:
+        _reload_lock.release()
+
+def _retrieve(topics: pd.DataFrame, br) -> pd.DataFrame:
+    # br comes from the request's snapshot, not the global, so reloads can't swap it mid-request
+    RETRIEVE_BATCH.observe(len(topics))
+    with RETRIEVE_SECONDS.time():
+        return br.transform(topics)
+
+def get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(
+            _retrieve,
+            max_batch=settings.search_batch_max,
+            max_wait_ms=settings.search_batch_wait_ms,
+            max_queue=settings.search_queue_max,
+        )
+    return _batcher
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    if _batcher is not None:
+        await _batcher.stop()
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the index is open (and warmed, if preloading)."""
+    warmed = "warmup_s" in _ready_info or not settings.preload_index
+    if not (_pt_ready and warmed):
+        raise HTTPException(status_code=503, detail=_ready_info.get("error") or "Index not loaded yet")
+    return {"ready": True, **_ready_info}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (this worker process only)."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 def health():
     return {
         "ok": True,
         "index_dir": settings.index_dir,
-        "index_exists": Path(settings.index_dir).exists()
+        "index_exists": Path(settings.index_dir).exists(),
+        "index_version": _live[0].version if _live is not None else None,
+        "batching": _batcher.stats() if _batcher is not None else None,
+        "result_cache": _cache.stats(),
     }
 
+def _build_hits(handle, res, top: int, requested: list[str]) -> list[dict]:
+    res = res.sort_values("rank").head(top)
+    docids = res["docid"].to_numpy()
+    # column-wise: one bulk fetch per field instead of per-hit lookups
+    with META_SECONDS.time():
+        cols = handle.fetch_fields(docids, [f for f in requested if f not in ("snippet", "duplicate_paths")])
+    if "snippet" in requested:
+        query = res["query"].iloc[0] if len(res) else ""
+        with SNIPPET_SECONDS.time():
+            cols["snippet"] = handle.snippets(docids, query, settings.snippet_chars)
+    # each hit stands for its duplicate cluster; the duplicates themselves aren't indexed
+    dups = [handle.duplicates.get(d, []) for d in res["docno"].tolist()]
+    if "duplicate_paths" in requested:
+        cols["duplicate_paths"] = dups
+    base = zip(res["docno"].tolist(), res["rank"].tolist(), res["score"].tolist(), dups)
+    out = [{"docno": d, "rank": int(r), "score": float(s), "duplicates": len(dd)} for d, r, s, dd in base]
+    for f in requested:
+        for item, v in zip(out, cols[f]):
+            item[f] = v
+    return out
+
+def _parse_fields(fields: Optional[str]) -> list[str]:
+    requested = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    allowed = {"title", "snippet", "content", "path", "content_type", "modified", "duplicate_paths"}
+    return [f for f in requested if f in allowed]
+
+def _json_response(payload: dict) -> Response:
+    with ENCODE_SECONDS.time():
+        body = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    return Response(body, media_type="application/json")
+
 @app.get("/search")
-def search(
+async def search(
     q: str = Query(..., description="Query string"),
     top: int = Query(10, ge=1, le=100),
-    fields: Optional[str] = Query("title,content", description="Comma-separated fields to return")
+    fields: Optional[str] = Query("title,snippet", description="Comma-separated fields to return "
+                                  "(snippet: query-biased excerpt; content: full stored body; "
+                                  "duplicate_paths: files collapsed into this hit)")
 ):
-    ensure_pyterrier()
+    t0 = time.perf_counter()
+    if not q.strip():
+        raise HTTPException(status_code=422, detail="Empty query")
+    if not _pt_ready:
+        await run_in_threadpool(ensure_pyterrier)
+    elif time.monotonic() - _last_index_check >= settings.index_check_interval_s:
+        await run_in_threadpool(maybe_reload_index)
 
-    import pandas as pd
-    qdf = pd.DataFrame([{"qid": "1", "query": q}])
-    res = _br.transform(qdf).sort_values(["qid", "rank"]).head(top)
+    requested = _parse_fields(fields)
 
-    # Pull stored metadata from the index
-    meta = _index.getMetaIndex()
-    requested = [f.strip() for f in (fields or "").split(",") if f.strip()]
-    allowed = {"title", "content", "path", "content_type", "modified"}
-    requested = [f for f in requested if f in allowed]
-
-    out = []
-    for _, row in res.iterrows():
-        docid = int(row["docid"])
-        item = {
-            "docno": row["docno"],
-            "rank": int(row["rank"]),
-            "score": float(row["score"]),
-        }
-        for f in requested:
-            try:
-                item[f] = meta.getItem(f, docid)
-            except Exception:
-                item[f] = None
-        out.append(item)
-
-    return {"query": q, "count": len(out), "value": out}
+    key = (canon_query(q), top, tuple(requested))
+    handle, br = _snapshot()
+    out = _cache.get(key)
+    if out is None:
+        # Concurrent requests are coalesced into one transform call
+        try:
+            res = await get_batcher().submit(q.strip(), br)
+        except Overloaded:
+            raise HTTPException(status_code=429, detail="Search queue full, retry later",
+                                headers={"Retry-After": "1"})
+
+        # Pull stored fields from the docstore / meta index
+        out = await run_in_threadpool(_build_hits, handle, res, top, requested)
+        # a reload since we started already invalidated the cache; don't refill it with old results
+        if _snapshot()[0] is handle:
+            _cache.put(key, out)
+    resp = _json_response({"query": q, "count": len(out), "value": out})
+    SEARCH_SECONDS.labels(endpoint="search").observe(time.perf_counter() - t0)
+    return resp
+
+class BatchQuery(BaseModel):
+    qid: Optional[str] = None
+    query: str
+
+class BatchSearchRequest(BaseModel):
+    queries: list[str | BatchQuery] = Field(..., description="Query strings or {qid, query} objects")
+    top: int = Field(10, ge=1, le=100)
+    fields: Optional[str] = Field("title", description="Comma-separated fields to return")
+
+def _batch_lines(handle, part: pd.DataFrame, res: pd.DataFrame, top: int, requested: list[str],
+                 errors: dict[str, str]) -> str:
+    groups = {qid: g for qid, g in res.groupby("qid", sort=False)}
+    lines = []
+    for qid, q in zip(part["qid"], part["query"]):
+        try:
+            if qid in errors:
+                raise RuntimeError(errors[qid])
+            g = groups.get(qid)
+            out = _build_hits(handle, g, top, requested) if g is not None else []
+            line = {"qid": qid, "query": q, "count": len(out), "value": out}
+        except Exception as e:
+            # the 200 and earlier lines are already sent; report the query in-band
+            line = {"qid": qid, "query": q, "error": str(e)}
+        lines.append(json.dumps(line, ensure_ascii=False))
+    return "\n".join(lines) + "\n"
+
+async def _run_chunk(batcher: MicroBatcher, topics: pd.DataFrame, br) -> tuple[pd.DataFrame, dict[str, str]]:
+    """Results of a chunk and {qid: error} for queries that failed. If the chunk
+    as a whole raises, its queries are retried one at a time."""
+    if not len(topics):
+        return pd.DataFrame(columns=["qid"]), {}
+    try:
+        return await batcher.run_frame(topics, br), {}
+    except Exception as e:
+        if len(topics) == 1:
+            return pd.DataFrame(columns=["qid"]), {topics["qid"].iloc[0]: str(e)}
+    parts, errors = [], {}
+    for i in range(len(topics)):
+        one = topics.iloc[i:i + 1]
+        try:
+            parts.append(await batcher.run_frame(one, br))
+        except Exception as e:
+            errors[one["qid"].iloc[0]] = str(e)
+    return (pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["qid"])), errors
+
+@app.post("/search/batch")
+async def search_batch(req: BatchSearchRequest):
+    """Run many queries as whole topics frames; streams one NDJSON line per query, in input order.
+    A query that fails gets a {qid, query, error} line instead of results."""
+    if len(req.queries) > settings.search_batch_request_max:
+        raise HTTPException(status_code=413,
+                            detail=f"Too many queries (max {settings.search_batch_request_max})")
+    if not _pt_ready:
+        await run_in_threadpool(ensure_pyterrier)
+    elif time.monotonic() - _last_index_check >= settings.index_check_interval_s:
+        await run_in_threadpool(maybe_reload_index)
+
+    requested = _parse_fields(req.fields)
+    topics = pd.DataFrame({
+        "qid": [(q.qid if isinstance(q, BatchQuery) and q.qid else str(i)) for i, q in enumerate(req.queries)],
+        "query": [(q.query if isinstance(q, BatchQuery) else q) for q in req.queries],
+    })
+    if topics["qid"].duplicated().any():
+        raise HTTPException(status_code=422, detail="Duplicate qid in batch")
+
+    handle, br = _snapshot()
+
+    async def _lines():
+        t0 = time.perf_counter()
+        batcher = get_batcher()
+        chunk = max(1, settings.search_batch_chunk)
+        for start in range(0, len(topics), chunk):
+            part = topics.iloc[start:start + chunk]
+            # Terrier rejects empty queries; they just get an empty result line
+            runnable = part[part["query"].str.strip() != ""]
+            res, errors = await _run_chunk(batcher, runnable, br)
+            yield await run_in_threadpool(_batch_lines, handle, part, res, req.top, requested, errors)
+        SEARCH_SECONDS.labels(endpoint="search_batch").observe(time.perf_counter() - t0)
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
@@ -1,9 +1,137 @@
-import pyterrier as pt
+import argparse
+import itertools
+import shutil
 from pathlib import Path
 from src.config import settings
-from src.extract import iter_docs
+from src.extract import iter_files
+from src.indexing import init_java, index_docs, open_cache, close_cache, docs_for, make_deduper
+from src import incremental as inc
+from src.dedup import release, write_table
+from src.sharding import build_sharded
+from src.checkpoint import build_checkpointed, finish
+from src.npindex import export as export_npindex
+
+def _corpus_files(doc_root: Path, wiki_root: Path):
+    workers = settings.crawl_workers
+    return itertools.chain(iter_files(doc_root, workers), iter_files(wiki_root, workers))
+
+def build_full(doc_root: Path, wiki_root: Path, index_root: Path, cache,
+               checkpoint_files: int = 0, restart: bool = False):
+    if checkpoint_files > 0:
+        print(f"Indexing into: {index_root / inc.SEGMENT_DIR} (checkpoint every {checkpoint_files} files)")
+        manifest = build_checkpointed(_corpus_files(doc_root, wiki_root), index_root, cache,
+                                      checkpoint_files, restart)
+        finish(index_root, manifest)
+        failed = manifest.get("failed", {})
+        print(f"Index complete: {len(manifest['components'])} segments, {len(manifest['docs'])} files"
+              + (f", {len(failed)} skipped after crashing the indexer" if failed else ""))
+        return
+    # the previous build's doc count is a good ETA estimate
+    previous = inc.load_manifest(index_root)
+    total = len(previous["docs"]) if previous else None
+    manifest = inc.empty_manifest()
+    dedup = make_deduper()
+    print(f"Indexing into: {index_root}")
+    docs = inc.track(docs_for(_corpus_files(doc_root, wiki_root), cache, dedup), manifest, inc.BASE)
+    indexref = index_docs(index_root, docs, total=total)
+    if dedup is not None:
+        dedup.commit(manifest, index_root)
+        print(dedup.summary())
+    inc.save_manifest(index_root, manifest)
+    print("Index complete.")
+    print("IndexRef:", indexref)
+
+def build_shards(doc_root: Path, wiki_root: Path, index_root: Path, n_shards: int):
+    print(f"Indexing {n_shards} shards into: {index_root / inc.SHARD_DIR}")
+    manifest = build_sharded(_corpus_files(doc_root, wiki_root), index_root, n_shards)
+    for name, info in manifest["shards"].items():
+        print(f"  {name}: files={info['files']} docs={info.get('docs', 0)}")
+    print("Index complete.")
+
+def build_delta(doc_root: Path, wiki_root: Path, index_root: Path, cache):
+    manifest = inc.load_manifest(index_root)
+    if manifest is None:
+        raise SystemExit(f"No {inc.MANIFEST_NAME} in {index_root}; run a full build first.")
+
+    changed, deleted = inc.scan_changes(_corpus_files(doc_root, wiki_root), manifest,
+                                       workers=settings.crawl_workers)
+    # duplicates whose indexed copy changed or went away get indexed in their own right
+    released = release(manifest, deleted + [str(fp) for fp in changed])
+    print(f"Changed/new: {len(changed)}  Deleted: {len(deleted)}"
+          + (f"  Released duplicates: {len(released)}" if released else ""))
+    changed += released
+    inc.mark_deleted(manifest, deleted)
+
+    if changed:
+        name = inc.next_delta_name(manifest)
+        delta_root = inc.component_path(index_root, name)
+        delta_root.mkdir(parents=True, exist_ok=True)
+        dedup = make_deduper()
+        if dedup is not None:
+            dedup.load(index_root, manifest, exclude=[str(fp) for fp in changed])
+        print(f"Indexing delta into: {delta_root}")
+        indexref = index_docs(delta_root, inc.track(docs_for(changed, cache, dedup), manifest, name),
+                              label=name, total=len(changed))
+        if dedup is not None:
+            dedup.commit(manifest, delta_root)
+            print(dedup.summary())
+        if any(e["index"] == name for e in manifest["docs"].values()):
+            manifest["components"].append(name)
+        else:
+            shutil.rmtree(delta_root, ignore_errors=True)  # all skipped; Terrier can't open an empty index
+        print("IndexRef:", indexref)
+
+    if changed or deleted:
+        manifest["version"] += 1
+        inc.save_manifest(index_root, manifest)
+    print(f"Delta complete. Components: {manifest['components']}")
+
+def compact(index_root: Path, cache):
+    """Rebuild the base from live documents only, folding deltas in and dropping deletions."""
+    manifest = inc.load_manifest(index_root)
+    if manifest is None:
+        raise SystemExit(f"No {inc.MANIFEST_NAME} in {index_root}; nothing to compact.")
+
+    live = [Path(d) for d in manifest["docs"]]
+    new_root = index_root.with_name(index_root.name + ".compact")
+    if new_root.exists():
+        shutil.rmtree(new_root)
+    new_root.mkdir(parents=True)
+
+    new_manifest = inc.empty_manifest()
+    new_manifest["version"] = manifest["version"] + 1
+    for key in ("failed", "skipped"):
+        if manifest.get(key):
+            new_manifest[key] = manifest[key]
+    dedup = make_deduper()
+    print(f"Compacting {len(live)} live docs from {len(manifest['components'])} components into: {new_root}")
+    indexref = index_docs(new_root, inc.track(docs_for(live, cache, dedup), new_manifest, inc.BASE),
+                          label="compact", total=len(live))
+    if dedup is not None:
+        dedup.commit(new_manifest, new_root)
+        print(dedup.summary())
+    inc.save_manifest(new_root, new_manifest)
+    inc.swap_in(index_root, new_root)
+    print("Compaction complete.")
+    print("IndexRef:", indexref)
 
 def main():
+    ap = argparse.ArgumentParser(description="Build the BM25 index over DOC_DIR and WIKI_DIR.")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true",
+                      help="index only new/changed files into a delta index")
+    mode.add_argument("--compact", action="store_true",
+                      help="fold delta indexes and deletions back into the base index")
+    ap.add_argument("--shards", type=int, default=settings.index_shards,
+                    help="full build: number of hash-partitioned shards, each indexed in its own process")
+    ap.add_argument("--checkpoint_files", type=int, default=settings.checkpoint_files,
+                    help="full build: commit a segment every N files so a crashed build can resume")
+    ap.add_argument("--restart", action="store_true",
+                    help="full build: discard an unfinished checkpointed build instead of resuming it")
+    ap.add_argument("--pruning_meta", action="store_true", default=settings.pruning_meta,
+                    help="afterwards, export the NumPy index for pruned retrieval and SEARCH_ENGINE=numpy")
+    args = ap.parse_args()
+
     doc_root = Path(settings.doc_dir)
     wiki_root = Path(settings.wiki_dir)
     index_root = Path(settings.index_dir)
@@ -15,32 +143,30 @@ def main():
 
     index_root.mkdir(parents=True, exist_ok=True)
 
-    # Heap tune; explicit init to avoid deprecation warning
-    pt.java.set_memory_limit(2048)
-    pt.java.init()
-
-    def _gen():
-        yield from iter_docs(doc_root, settings.max_bytes_per_file)
-        yield from iter_docs(wiki_root, settings.max_bytes_per_file)
-
-    indexer = pt.IterDictIndexer(
-        str(index_root),
-        fields=["text", "title"],          # <-- TEXT fields for BM25
-        meta={
-            "docno": 2048,
-            "path": 2048,
-            "title": 1024,
-            "content": 4096,               # optional: store full content for API
-            "content_type": 256,
-            "modified": 64,
-        },
-        blocks=False
-    )
+    if not (args.compact or args.incremental) and args.shards > 1:
+        # each shard process starts its own JVM and extraction cache
+        build_shards(doc_root, wiki_root, index_root, args.shards)
+        init_java()
+    else:
+        init_java()
+        cache = open_cache()
 
-    print(f"Indexing into: {index_root}")
-    indexref = indexer.index(_gen())
-    print("Index complete.")
-    print("IndexRef:", indexref)
+        if args.compact:
+            compact(index_root, cache)
+        elif args.incremental:
+            build_delta(doc_root, wiki_root, index_root, cache)
+        else:
+            build_full(doc_root, wiki_root, index_root, cache, args.checkpoint_files, args.restart)
+
+        close_cache(cache)
+
+    manifest = inc.load_manifest(index_root)
+    if manifest and manifest.get("skipped"):
+        print(f"Skipped files and duplicate clusters: {write_table(index_root, manifest)}")
+
+    if args.pruning_meta or settings.search_engine == "numpy":
+        # covers every component, so it is redone after deltas and compactions too
+        export_npindex(index_root)
 
 if __name__ == "__main__":
     main()
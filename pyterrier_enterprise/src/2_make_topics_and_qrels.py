@@ -1,26 +1,55 @@
-import argparse, csv, hashlib, io, sys, re
+import argparse, csv, hashlib, os, sys, re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse, unquote
 
-def build_wiki_index(wiki_dir: Path) -> dict[str, Path]:
+from src.queries import canon_query
+
+def list_dir_sizes(d: Path, workers: int = 16) -> dict[str, int]:
+    """One scandir pass over d -> {file name: size}.
+
+    Replaces per-row exists()/stat() probes, which each cost a round-trip on
+    the rclone mount. Entry stats are resolved on a thread pool (free on
+    Windows, where scandir already carries the size)."""
+    with os.scandir(d) as it:
+        entries = [e for e in it if e.is_file()]
+
+    def _size(e):
+        try:
+            return e.name, e.stat().st_size
+        except OSError:
+            return e.name, -1
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return dict(pool.map(_size, entries, chunksize=256))
+
+def case_insensitive(d: Path, names: dict[str, int]) -> bool:
+    """Whether d resolves names regardless of case (Windows, SMB mounts), as
+    the per-row Path.exists() probes did. Costs one probe."""
+    for name in names:
+        alt = name.swapcase()
+        if alt != name and alt not in names:
+            return (d / alt).exists()
+    return os.name == "nt"
+
+def build_wiki_index(wiki_files: dict[str, int]) -> dict[str, str]:
+    """wiki_id -> file name, from a list_dir_sizes() listing."""
     idx = {}
-    for p in list(wiki_dir.glob("*.htm")) + list(wiki_dir.glob("*.html")):
-        name = p.name  # e.g., "3669476_Kernel-Mode_Driver_Framework.html"
+    for name in wiki_files:
+        if not name.lower().endswith((".htm", ".html")):
+            continue
+        # e.g., "3669476_Kernel-Mode_Driver_Framework.html"
         if "_" in name:
             wiki_id = name.split("_", 1)[0]
             # prefer first seen; if there are multiple, keep the shortest filename
-            if wiki_id not in idx or len(p.name) < len(idx[wiki_id].name):
-                idx[wiki_id] = p
+            if wiki_id not in idx or len(name) < len(idx[wiki_id]):
+                idx[wiki_id] = name
     return idx
 
 
 def log(msg: str, *, flush=True):
     print(msg, flush=flush)
 
-def canon_query(q: str) -> str:
-    # normalize for dedup (same string across rows -> same qid)
-    return " ".join((q or "").strip().split()).lower()
-
 def qid_for(cq: str) -> str:
     # stable id: 12 hex chars -> int string
     return str(int(hashlib.sha1(cq.encode("utf-8")).hexdigest()[:12], 16))
@@ -29,30 +58,23 @@ def basename_from_url(u: str) -> str:
     p = urlparse(u or "")
     return Path(unquote(p.path)).name if p.path else ""
 
-def find_wiki_html(wiki_dir: Path, wiki_id: str):
-    # simple: first file that starts with "<id>_"
-    for cand in list(wiki_dir.glob(f"{wiki_id}_*.htm")) + list(wiki_dir.glob(f"{wiki_id}_*.html")):
-        return cand
-    return None
-
-def file_nonempty(p: Path) -> bool:
-    try:
-        return p.exists() and p.is_file() and p.stat().st_size > 0
-    except Exception:
-        return False
-
-def open_tsv_utf8(path: Path):
-    # robust open: try utf-8 then BOM/utf-16 fallbacks
-    try:
-        return open(path, "r", encoding="utf-8", newline="")
-    except UnicodeError:
-        raw = open(path, "rb").read()
-        for enc in ("utf-8-sig", "utf-16", "utf-16-le", "utf-16-be", "cp1252"):
-            try:
-                return io.StringIO(raw.decode(enc))
-            except Exception:
-                pass
-        raise
+def open_tsv(path: Path, buffer_bytes: int = 1 << 20):
+    """Stream the TSV in buffer_bytes chunks, sniffing the encoding from its
+    first bytes (BOM / utf-16 / cp1252) instead of decoding the whole file."""
+    with open(path, "rb") as fb:
+        head = fb.read(64 * 1024)
+    if head.startswith(b"\xef\xbb\xbf"):
+        enc = "utf-8-sig"
+    elif head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        enc = "utf-16"
+    else:
+        try:
+            head.decode("utf-8")
+            enc = "utf-8"
+        except UnicodeDecodeError as e:
+            # a multibyte char cut at the 64K boundary is still utf-8
+            enc = "utf-8" if e.start >= len(head) - 3 else "cp1252"
+    return open(path, "r", encoding=enc, errors="replace", newline="", buffering=buffer_bytes)
 
 def main():
     ap = argparse.ArgumentParser(description="Build topics (qid↔query) and qrels from SuggestedQueriesDone.tsv")
@@ -66,6 +88,8 @@ def main():
     ap.add_argument("--wiki_rel", type=int, default=1)
     ap.add_argument("--max_queries_per_row", type=int, default=5)
     ap.add_argument("--verbose", action="store_true", help="Print per-row progress")
+    ap.add_argument("--stat_workers", type=int, default=16, help="Threads for the up-front directory listing")
+    ap.add_argument("--read_buffer_mb", type=int, default=4, help="TSV read chunk size (large chunks help on rclone mounts)")
     args = ap.parse_args()
 
     tsv_path = Path(args.tsv)
@@ -96,10 +120,16 @@ def main():
 
     # Accumulators
     queries_seen: dict[str, tuple[str,str]] = {}  # canon -> (qid, first_seen_original)
-    qrels_lines: list[tuple[str,str,int]] = []    # (qid, docno, rel)
-
-    wiki_lookup = build_wiki_index(wiki_dir)
+    qrels_count = 0
 
+    # One listing per directory up front; rows are then resolved from memory
+    doc_sizes = list_dir_sizes(doc_dir, args.stat_workers)
+    wiki_sizes = list_dir_sizes(wiki_dir, args.stat_workers)
+    wiki_lookup = build_wiki_index(wiki_sizes)
+    # on Windows/SMB mounts a URL name may differ in case from the file on disk
+    fold = case_insensitive(doc_dir, doc_sizes)
+    folded = {k.casefold(): k for k in doc_sizes} if fold else {}
+    log(f"Listed   : docs={len(doc_sizes)} wiki={len(wiki_sizes)} (case-insensitive: {fold})")
 
     total_rows = 0
     with_docs  = 0
@@ -108,71 +138,75 @@ def main():
     missing_doc = empty_doc = 0
     missing_wiki = empty_wiki = 0
 
-    f = open_tsv_utf8(tsv_path)
-    reader = csv.reader(f, delimiter="\t")
-    for row in reader:
-        if not row or len(row) < 4:
-            continue
-        # detect & skip header (first cell not all digits)
-        if total_rows == 0 and not row[0].strip().isdigit():
-            if args.verbose: log("Header row detected, skipping")
-            continue
-
-        total_rows += 1
-        wiki_id, wiki_title, wiki_url, tgt_url, *query_cols = row
-        # use only up to N query columns
-        query_cols = [q for q in query_cols[:args.max_queries_per_row] if q and q.strip()]
-
-        # Map document path
-        doc_ok = False
-        docno = None
-        base = basename_from_url(tgt_url)
-        if base:
-            docno = str((doc_dir / f"{wiki_id}_{base}"))
-            p = Path(docno)
-            if not p.exists():
+    # qrels are streamed to disk as rows are processed
+    with open(qrels_out, "w", encoding="utf-8") as fq, open_tsv(tsv_path, args.read_buffer_mb << 20) as f:
+        reader = csv.reader(f, delimiter="\t")
+        for row in reader:
+            if not row or len(row) < 4:
+                continue
+            # detect & skip header (first cell not all digits)
+            if total_rows == 0 and not row[0].strip().isdigit():
+                if args.verbose: log("Header row detected, skipping")
+                continue
+
+            total_rows += 1
+            wiki_id, wiki_title, wiki_url, tgt_url, *query_cols = row
+            # use only up to N query columns
+            query_cols = [q for q in query_cols[:args.max_queries_per_row] if q and q.strip()]
+
+            # Map document path
+            doc_ok = False
+            docno = None
+            base = basename_from_url(tgt_url)
+            if base:
+                name = f"{wiki_id}_{base}"
+                if fold:
+                    name = folded.get(name.casefold(), name)  # the name as indexed
+                docno = str((doc_dir / name))
+                size = doc_sizes.get(name)
+                if size is None:
+                    missing_doc += 1
+                elif size <= 0:
+                    empty_doc += 1
+                else:
+                    doc_ok = True
+                    with_docs += 1
+            else:
                 missing_doc += 1
-            elif not file_nonempty(p):
-                empty_doc += 1
+
+            # Map wiki path
+            wiki_ok = False
+            wname = wiki_lookup.get(wiki_id)
+
+            if wname is None:
+                missing_wiki += 1
+            elif wiki_sizes[wname] <= 0:
+                empty_wiki += 1
             else:
-                doc_ok = True
-                with_docs += 1
-        else:
-            missing_doc += 1
-
-        # Map wiki path
-        wiki_ok = False
-        wpath = wiki_lookup.get(wiki_id)
-
-        if wpath is None:
-            missing_wiki += 1
-        elif not file_nonempty(wpath):
-            empty_wiki += 1
-        else:
-            wiki_ok = True
-            with_wiki += 1
-            wdoc = str(wpath)
-
-        # Assign qids and add qrels
-        if query_cols:
-            for q in query_cols:
-                cq = canon_query(q)
-                if not cq:
-                    continue
-                if cq not in queries_seen:
-                    queries_seen[cq] = (qid_for(cq), q)
-                qid = queries_seen[cq][0]
-                if doc_ok:
-                    qrels_lines.append((qid, docno, args.doc_rel))
-                if wiki_ok:
-                    qrels_lines.append((qid, wdoc, args.wiki_rel))
-            if doc_ok or wiki_ok:
-                rows_with_any += 1
-
-        if args.verbose and total_rows % 20 == 0:
-            log(f"[{total_rows}] queries_seen={len(queries_seen)} qrels={len(qrels_lines)}")
-
-    f.close()
+                wiki_ok = True
+                with_wiki += 1
+                wdoc = str(wiki_dir / wname)
+
+            # Assign qids and add qrels
+            if query_cols:
+                for q in query_cols:
+                    cq = canon_query(q)
+                    if not cq:
+                        continue
+                    if cq not in queries_seen:
+                        queries_seen[cq] = (qid_for(cq), q)
+                    qid = queries_seen[cq][0]
+                    if doc_ok:
+                        fq.write(f"{qid} 0 {docno} {args.doc_rel}\n")
+                        qrels_count += 1
+                    if wiki_ok:
+                        fq.write(f"{qid} 0 {wdoc} {args.wiki_rel}\n")
+                        qrels_count += 1
+                if doc_ok or wiki_ok:
+                    rows_with_any += 1
+
+            if args.verbose and total_rows % 20 == 0:
+                log(f"[{total_rows}] queries_seen={len(queries_seen)} qrels={qrels_count}")
 
     # Write topics
     with open(topics_out, "w", encoding="utf-8", newline="") as ft:
@@ -180,11 +214,6 @@ def main():
         for cq,(qid,orig) in sorted(queries_seen.items(), key=lambda kv: kv[1][0]):
             w.writerow([qid, orig])
 
-    # Write qrels
-    with open(qrels_out, "w", encoding="utf-8") as fq:
-        for qid, docno, rel in qrels_lines:
-            fq.write(f"{qid} 0 {docno} {rel}\n")
-
     # Write map (for audit)
     with open(map_out, "w", encoding="utf-8", newline="") as fm:
         w = csv.writer(fm, delimiter="\t", lineterminator="\n")
@@ -197,7 +226,7 @@ def main():
     log(f"Rows processed      : {total_rows}")
     log(f"Rows w/ any files   : {rows_with_any}")
     log(f"Unique queries      : {len(queries_seen)}")
-    log(f"Qrels lines         : {len(qrels_lines)}")
+    log(f"Qrels lines         : {qrels_count}")
     log(f"Docs OK             : {with_docs}   (missing={missing_doc}, empty={empty_doc})")
     log(f"Wiki OK             : {with_wiki}   (missing={missing_wiki}, empty={empty_wiki})")
     log(f"topics.tsv bytes    : {topics_out.stat().st_size if topics_out.exists() else 0}")
@@ -1,24 +1,21 @@
 # src/sample_and_eval.py
 import argparse
 import random
-import re
+import time
 from pathlib import Path
 
+import ir_measures
 import pandas as pd
 import pyterrier as pt
 from ir_measures import AP, nDCG, P, R  # metric objects
 
-_QREL_RE = re.compile(r"^(\S+)\s+(\S+)\s+(.*)\s+(-?\d+)\s*$")
-FIELDY = re.compile(r'\b(?:site|filetype|inurl|intitle|ext):\S+', re.IGNORECASE)
-ONLY_ALNUM = re.compile(r"[A-Za-z0-9]+")
-
-def clean_query(q: str) -> str:
-    if not isinstance(q, str):
-        return ""
-    q = FIELDY.sub(" ", q)
-    q = q.replace('"', " ").replace("'", " ")
-    toks = ONLY_ALNUM.findall(q.lower())
-    return " ".join(toks).strip()
+from src.queries import clean_query
+from src.retrieval import IndexHandle
+from src.runs import read_qrels, add_ranks, write_run
+from src.full_eval import run_full, summarize
+from src.npindex import NpIndex, StringTable
+from src.npsearch import TerrierTermPipeline
+from src.sweep import build_pool, grid, sweep
 
 def read_queries(map_path: Path | None, topics_path: Path | None) -> pd.DataFrame:
     if map_path:
@@ -31,25 +28,6 @@ def read_queries(map_path: Path | None, topics_path: Path | None) -> pd.DataFram
     df["query"] = df["query"].fillna("").str.strip()
     return df[df["query"] != ""].drop_duplicates(subset=["qid"])
 
-def read_qrels(qrels_path: Path) -> pd.DataFrame:
-    recs = []
-    with open(qrels_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            line = line.rstrip("\r\n")
-            if not line:
-                continue
-            m = _QREL_RE.match(line)
-            if not m:
-                continue
-            qid, _, docno, label = m.groups()
-            recs.append((qid, docno, int(label)))
-    if not recs:
-        raise RuntimeError(f"No qrels parsed from {qrels_path}")
-    df = pd.DataFrame(recs, columns=["qid", "docno", "label"])
-    df["qid"] = df["qid"].astype(str)
-    df["docno"] = df["docno"].astype(str)
-    return df
-
 def parse_metric(token: str):
     tok = token.strip()
     if "@" in tok:
@@ -76,6 +54,99 @@ def parse_metric(token: str):
         return R @ k
     raise ValueError(f"Unknown metric: {token}")
 
+def run_full_set(args, index_path: Path, topics: pd.DataFrame, qrels: pd.DataFrame, metric_objs):
+    out_dir = Path(args.out_dir)
+    out_run = Path(args.run_out)
+    fmt = args.run_format
+    if fmt == "auto":
+        fmt = "parquet" if out_run.suffix.lower() == ".parquet" else "trec"
+    per_query = run_full(
+        topics, qrels, index_path, [str(m) for m in metric_objs], args.k, out_dir, args.tag,
+        chunk_size=args.chunk_size, workers=args.workers, threads=args.threads,
+        heap_mb=args.heap_mb, agg=args.passage_agg, passage_depth=args.passage_depth,
+        pruning=None if args.pruning == "none" else args.pruning,
+        run_ext=".parquet" if fmt == "parquet" else ".trec", out_run=out_run,
+    )
+    per_query.to_csv(out_dir / "per_query.csv", index=False)
+
+    summary = summarize(per_query)
+    out_metrics = Path(args.metrics_out)
+    out_metrics.parent.mkdir(parents=True, exist_ok=True)
+    # same wide layout as the sample mode, plus a long table with CIs next to it
+    wide = pd.DataFrame([{"name": args.tag, **dict(zip(summary["measure"], summary["mean"]))}])
+    wide.to_csv(out_metrics, index=False)
+    out_ci = out_metrics.with_name(out_metrics.stem + "_ci.csv")
+    summary.insert(0, "name", args.tag)
+    summary.to_csv(out_ci, index=False)
+
+    print("=== Full Eval Summary ===", flush=True)
+    print(f"Topics          : {len(topics)}", flush=True)
+    print(f"Index           : {index_path}", flush=True)
+    print(f"Run             : {out_run}", flush=True)
+    print(f"Per-query       : {out_dir / 'per_query.csv'}", flush=True)
+    print(f"Metrics CSV     : {out_metrics} (+ {out_ci.name})", flush=True)
+    print(summary.to_string(index=False), flush=True)
+
+def parse_weights(specs: list[str]) -> dict[str, list[float]]:
+    """["title=1,2,4"] -> {"title": [1.0, 2.0, 4.0]}"""
+    out = {}
+    for spec in specs:
+        field, sep, values = spec.partition("=")
+        if not sep or not values:
+            raise ValueError(f"Field weights look like title=1,2,4, not {spec}")
+        out[field.strip().lower()] = [float(v) for v in values.split(",") if v.strip()]
+    return out
+
+def run_sweep(args, index_path: Path, topics: pd.DataFrame, qrels: pd.DataFrame, metric_objs):
+    npx = NpIndex.open(index_path)
+    if npx is None:
+        raise SystemExit(f"No up-to-date npindex under {index_path}; run "
+                         f"`python -m src.5_export_index --index {index_path}` first")
+    weights = parse_weights(args.sweep_weights)
+    missing = set(weights) - set(npx.fields)
+    if missing:
+        raise SystemExit(f"No field {', '.join(sorted(missing))} in the export (fields: {npx.fields or 'none'}); "
+                         "re-export an index built with fields to sweep field weights")
+    passages = npx.meta["passages"]
+    depth = args.pool_depth or 2 * args.k
+    if passages:
+        depth *= max(1, args.passage_depth)
+
+    t0 = time.perf_counter()
+    pool = build_pool(npx, topics, TerrierTermPipeline(npx.meta.get("termpipelines", "Stopwords,PorterStemmer")),
+                      StringTable(npx.root, "docno").get_many, depth, passages, args.passage_agg)
+    pool.judge(qrels)
+    print(f"Pooled {len(pool)} candidates for {len(topics)} queries (depth {depth}) "
+          f"in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    measures = [str(m) for m in metric_objs]
+    configs = grid(args.sweep_k1, args.sweep_b, weights)
+    table = sweep(pool, configs, measures, args.k)
+    table = table.sort_values(measures[0], ascending=False, kind="stable").reset_index(drop=True)
+    out_metrics = Path(args.metrics_out)
+    out_metrics.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(out_metrics, index=False)
+
+    # the best configuration's run, re-checked with ir_measures
+    best = table.iloc[0]
+    best_weights = {c[2:]: best[c] for c in table.columns if c.startswith("w_")}
+    run_df = pool.run(pool.unit_scores(pool.score(best["k1"], best["b"], best_weights)), args.k)
+    out_run = Path(args.run_out)
+    write_run(run_df, out_run, args.tag, args.run_format)
+    check = ir_measures.calc_aggregate(
+        metric_objs, qrels.rename(columns={"qid": "query_id", "docno": "doc_id", "label": "relevance"}),
+        run_df[["qid", "docno", "score"]].rename(columns={"qid": "query_id", "docno": "doc_id"}))
+
+    print("=== BM25 Sweep Summary ===", flush=True)
+    print(f"Queries         : {len(topics)}", flush=True)
+    print(f"Index           : {index_path}", flush=True)
+    print(f"Configurations  : {len(table)}", flush=True)
+    print(f"Metrics CSV     : {out_metrics}", flush=True)
+    print(f"Best run        : {out_run}", flush=True)
+    print(table.head(10).to_string(index=False), flush=True)
+    print("Best, by ir_measures: " + ", ".join(f"{m}={v:.4f}" for m, v in
+                                                ((str(m), check.get(m, float("nan"))) for m in metric_objs)), flush=True)
+
 def main():
     ap = argparse.ArgumentParser(description="Sample queries, run BM25, and evaluate with qrels.")
     ap.add_argument("--index", required=True, help="PyTerrier index directory")
@@ -88,11 +159,36 @@ def main():
     ap.add_argument("--k", type=int, default=1000, help="retrieval depth")
     ap.add_argument("--metrics", nargs="+", default=["AP", "nDCG@10", "P@10", "R@100"])
     ap.add_argument("--run_out", default="./runs/sample_bm25.trec")
+    ap.add_argument("--run_format", choices=["auto", "trec", "parquet"], default="auto",
+                    help="auto picks parquet when --run_out ends in .parquet")
     ap.add_argument("--metrics_out", default="./runs/sample_metrics.csv")
     ap.add_argument("--tag", default="BM25")
+    ap.add_argument("--all", action="store_true",
+                    help="evaluate every topic (chunked, parallel, resumable) instead of a --n sample")
+    ap.add_argument("--chunk_size", type=int, default=1000, help="--all: topics per chunk")
+    ap.add_argument("--workers", type=int, default=1, help="--all: worker processes, each with its own JVM")
+    ap.add_argument("--threads", type=int, default=1, help="Terrier retrieval threads per JVM")
+    ap.add_argument("--heap_mb", type=int, default=2048, help="--all: JVM heap per worker")
+    ap.add_argument("--passage_agg", choices=["max", "first"], default="max",
+                    help="passage indexes: score a document by its best (MaxP) or first (FirstP) passage")
+    ap.add_argument("--passage_depth", type=int, default=3,
+                    help="passage indexes: passages retrieved per document in --k")
+    ap.add_argument("--pruning", choices=["none", "maxscore", "blockmax"], default="none",
+                    help="safe dynamic pruning over the npindex export (same top-k as exhaustive BM25)")
+    ap.add_argument("--out_dir", default="./runs/full_eval", help="--all: chunk outputs; rerun to resume")
+    ap.add_argument("--sweep", action="store_true",
+                    help="grid-search BM25 parameters: retrieve a candidate pool once from the npindex export, "
+                         "re-score it per configuration; one metrics row per configuration in --metrics_out")
+    ap.add_argument("--sweep_k1", type=float, nargs="+", default=[0.6, 0.9, 1.2, 1.5, 1.8, 2.1])
+    ap.add_argument("--sweep_b", type=float, nargs="+", default=[0.3, 0.45, 0.6, 0.75, 0.9])
+    ap.add_argument("--sweep_weights", nargs="*", default=[],
+                    help="field weights to sweep, e.g. title=1,2,3,5 (others stay 1)")
+    ap.add_argument("--pool_depth", type=int, default=0,
+                    help="--sweep: candidates pooled per query (default 2 x --k)")
     args = ap.parse_args()
 
-    pt.java.init()
+    if args.sweep or not args.all:
+        pt.java.init()
 
     index_path = Path(args.index)
     if not index_path.exists():
@@ -106,15 +202,18 @@ def main():
     if queries.empty:
         raise RuntimeError("All queries became empty after cleaning.")
 
-    # Sample once
-    random.seed(args.seed)
-    n_sample = min(args.n, len(queries))
-    topics = queries.sample(n=n_sample, random_state=args.seed).copy().reset_index(drop=True)
+    if args.all:
+        topics = queries.copy()
+    else:
+        # Sample once
+        random.seed(args.seed)
+        n_sample = min(args.n, len(queries))
+        topics = queries.sample(n=n_sample, random_state=args.seed).copy().reset_index(drop=True)
 
-    # Show a peek
-    print("Sampled queries (qid → query):")
-    for _, r in topics.head(10).iterrows():
-        print(f"  {r['qid']} → {r['query']}")
+        # Show a peek
+        print("Sampled queries (qid → query):")
+        for _, r in topics.head(10).iterrows():
+            print(f"  {r['qid']} → {r['query']}")
 
     if topics.empty:
         raise RuntimeError("No queries found after cleaning/sampling.")
@@ -143,19 +242,28 @@ def main():
     if topics.empty:
         raise RuntimeError("No valid queries remain after cleaning; increase --n or change --seed.")
 
-    # Retriever (BM25)
-# replace your retr = pt.terrier.Retriever(...controls=...) % args.k
-    retr = pt.terrier.Retriever(index_path.as_posix(), wmodel="BM25") % args.k
-# or (also fine)
-# retr = pt.BatchRetrieve(index_path.as_posix(), wmodel="BM25") % args.k
-
-
     # Metrics
     metric_objs = [parse_metric(m) for m in args.metrics]
 
+    if args.sweep:
+        run_sweep(args, index_path, topics, qrels_sample, metric_objs)
+        return
+
+    if args.all:
+        run_full_set(args, index_path, topics, qrels_sample, metric_objs)
+        return
+
+    # Retriever (BM25) over the base index plus any incremental deltas
+    retr = IndexHandle(index_path).retriever(wmodel="BM25", k=args.k, threads=args.threads,
+                                             agg=args.passage_agg, passage_depth=args.passage_depth,
+                                             pruning=None if args.pruning == "none" else args.pruning)
+
+    # Retrieve once; the same frame feeds both evaluation and the run file
+    run_df = add_ranks(retr.transform(topics))
+
     # Run experiment
     res = pt.Experiment(
-        [retr],
+        [run_df],
         topics,
         qrels_sample,
         eval_metrics=metric_objs,
@@ -163,28 +271,9 @@ def main():
         verbose=True,
     )
 
-    # Save TREC run (rank starts at 1)
-# Also save a TREC run for the sampled topics
-    run_df = retr.transform(topics)
-
-    # Ensure required columns exist
-    missing = {"qid", "docno", "score"} - set(run_df.columns)
-    if missing:
-        raise RuntimeError(f"Retriever output missing columns: {missing}")
-
-    run_df = run_df.sort_values(["qid", "score"], ascending=[True, False]).copy()
-    run_df["rank"] = run_df.groupby("qid").cumcount() + 1  # 1-based for TREC
-
-    # Build TREC lines (vectorized; avoids Series attribute pitfalls)
-    trec_lines = run_df.apply(
-        lambda r: f"{r['qid']} Q0 {r['docno']} {int(r['rank'])} {float(r['score']):.6f} {args.tag}",
-        axis=1,
-    ).tolist()
-
+    # Save run (rank starts at 1)
     out_run = Path(args.run_out)
-    out_run.parent.mkdir(parents=True, exist_ok=True)
-    out_run.write_text("\n".join(trec_lines) + ("\n" if trec_lines else ""), encoding="utf-8")
-
+    write_run(run_df, out_run, args.tag, args.run_format)
 
     # Save metrics CSV
     out_metrics = Path(args.metrics_out)
@@ -0,0 +1,235 @@
+# src/benchmark.py
+import argparse
+import json
+import platform
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.queries import clean_query
+
+def read_topics(path: Path, n: int, seed: int) -> list[str]:
+    df = pd.read_csv(path, sep="\t", header=None, names=["qid", "query"], dtype=str)
+    df["query"] = df["query"].map(clean_query)
+    df = df[df["query"] != ""]
+    if n and n < len(df):
+        df = df.sample(n=n, random_state=seed)
+    return df["query"].tolist()
+
+def latency_stats(lat_s: list[float], wall_s: float) -> dict:
+    a = np.asarray(lat_s, dtype=float) * 1000.0
+    if not len(a):
+        return {"n": 0}
+    return {
+        "n": int(len(a)),
+        "qps": len(a) / wall_s if wall_s > 0 else None,
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(np.percentile(a, 50)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "max_ms": float(a.max()),
+    }
+
+def jvm_heap() -> dict:
+    import pyterrier as pt
+    rt = pt.java.autoclass("java.lang.Runtime").getRuntime()
+    mb = 1024 * 1024
+    return {
+        "used_mb": (rt.totalMemory() - rt.freeMemory()) / mb,
+        "total_mb": rt.totalMemory() / mb,
+        "max_mb": rt.maxMemory() / mb,
+    }
+
+def bench_inproc(queries: list[str], args) -> dict:
+    """Replay queries one at a time through the same path as /search
+    (retrieve -> fetch fields -> JSON), timing each stage, then once more as
+    batched topics frames for throughput."""
+    import pyterrier as pt
+    from src.npsearch import NpHandle
+    from src.retrieval import IndexHandle, LOAD_MODES
+
+    t0 = time.perf_counter()
+    if args.engine == "numpy":
+        handle = NpHandle(args.index)
+    else:
+        if not pt.java.started():
+            pt.java.set_memory_limit(args.heap_mb)
+            pt.java.init()
+        handle = IndexHandle(args.index, memory=LOAD_MODES[args.load_mode])
+    br = handle.retriever(wmodel="BM25", k=args.k, threads=args.threads,
+                          pruning=None if args.pruning == "none" else args.pruning)
+    load_s = time.perf_counter() - t0
+    fields = [f for f in args.fields.split(",") if f]
+
+    def _one(q: str) -> dict:
+        s0 = time.perf_counter()
+        res = br.transform(pd.DataFrame([{"qid": "1", "query": q}]))
+        s1 = time.perf_counter()
+        res = res.head(args.top)
+        cols = handle.fetch_fields(res["docid"].to_numpy(), fields)
+        s2 = time.perf_counter()
+        json.dumps({"docno": res["docno"].tolist(), "score": res["score"].tolist(), **cols})
+        s3 = time.perf_counter()
+        return {"retrieve": s1 - s0, "fetch_fields": s2 - s1, "serialize": s3 - s2, "total": s3 - s0}
+
+    for q in queries[:args.warmup]:
+        _one(q)
+
+    timings = []
+    wall0 = time.perf_counter()
+    for q in queries:
+        timings.append(_one(q))
+    wall = time.perf_counter() - wall0
+
+    out = {
+        "load_s": load_s,
+        "single": latency_stats([t["total"] for t in timings], wall),
+        # per-stage latency only; QPS is a property of the whole request
+        "stages": {s: latency_stats([t[s] for t in timings], 0.0)
+                   for s in ("retrieve", "fetch_fields", "serialize")},
+    }
+
+    # batched throughput: whole topics frames, as /search/batch and eval do
+    topics = pd.DataFrame({"qid": [str(i) for i in range(len(queries))], "query": queries})
+    lat, wall0 = [], time.perf_counter()
+    for s in range(0, len(topics), args.batch_size):
+        b0 = time.perf_counter()
+        br.transform(topics.iloc[s:s + args.batch_size])
+        lat.append(time.perf_counter() - b0)
+    wall = time.perf_counter() - wall0
+    out["batched"] = {"batch_size": args.batch_size, "qps": len(queries) / wall if wall > 0 else None,
+                      "batch": latency_stats(lat, wall)}
+    if pt.java.started():
+        out["jvm_heap"] = jvm_heap()
+    return out
+
+def bench_http(queries: list[str], args) -> dict:
+    """Replay queries against a running server at the given concurrency."""
+    base = args.url.rstrip("/")
+
+    def _get(q: str) -> tuple[float, int]:
+        qs = urllib.parse.urlencode({"q": q, "top": args.top, "fields": args.fields})
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{base}/search?{qs}", timeout=args.timeout) as r:
+                r.read()
+                status = r.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = -1
+        return time.perf_counter() - t0, status
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(_get, queries[:args.warmup]))
+        wall0 = time.perf_counter()
+        results = list(pool.map(_get, queries))
+        wall = time.perf_counter() - wall0
+
+    ok = [lat for lat, st in results if st == 200]
+    statuses: dict[str, int] = {}
+    for _, st in results:
+        statuses[str(st)] = statuses.get(str(st), 0) + 1
+    out = {"concurrency": args.concurrency, "latency": latency_stats(ok, wall), "status_counts": statuses}
+    # served-side view (cache hit rate, batch sizes) if the server exposes it
+    try:
+        with urllib.request.urlopen(f"{base}/health", timeout=args.timeout) as r:
+            out["server_health"] = json.loads(r.read())
+    except Exception:
+        pass
+    return out
+
+COMPARE_KEYS = ("p50_ms", "p95_ms", "p99_ms", "qps")
+
+def _flat_stats(result: dict, prefix: str = "") -> dict:
+    flat = {}
+    for k, v in result.items():
+        if isinstance(v, dict):
+            flat.update(_flat_stats(v, f"{prefix}{k}."))
+        elif k in COMPARE_KEYS and isinstance(v, (int, float)):
+            flat[f"{prefix}{k}"] = float(v)
+    return flat
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions beyond tolerance (fraction): slower latencies or lower QPS."""
+    cur, base = _flat_stats(current["results"]), _flat_stats(baseline["results"])
+    regressions = []
+    for key in sorted(cur.keys() & base.keys()):
+        b, c = base[key], cur[key]
+        if not b:
+            continue
+        change = (c - b) / b
+        worse = change < -tolerance if key.endswith("qps") else change > tolerance
+        print(f"  {key:40s} {b:10.2f} -> {c:10.2f} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark BM25 latency/throughput in-process and over HTTP.")
+    ap.add_argument("--topics", default="./runs/topics.tsv", help="topics.tsv (qid<TAB>query) to replay")
+    ap.add_argument("--n", type=int, default=500, help="queries to replay (0 = all)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--mode", choices=["inproc", "http", "both"], default="inproc")
+    ap.add_argument("--index", help="index directory (inproc)")
+    ap.add_argument("--load_mode", choices=["disk", "fileinmem", "memory"], default="disk")
+    ap.add_argument("--heap_mb", type=int, default=2048)
+    ap.add_argument("--k", type=int, default=100, help="retrieval depth")
+    ap.add_argument("--top", type=int, default=10, help="hits whose fields are fetched")
+    ap.add_argument("--fields", default="title,content")
+    ap.add_argument("--threads", type=int, default=1, help="Terrier retrieval threads (inproc)")
+    ap.add_argument("--pruning", choices=["none", "maxscore", "blockmax"], default="none",
+                    help="inproc: pruned retrieval over the npindex export")
+    ap.add_argument("--engine", choices=["terrier", "numpy"], default="terrier",
+                    help="inproc: numpy serves from the npindex export without a JVM")
+    ap.add_argument("--batch_size", type=int, default=100, help="topics per transform in the batched pass")
+    ap.add_argument("--url", default="http://127.0.0.1:8000", help="server base URL (http)")
+    ap.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP clients")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--warmup", type=int, default=20, help="queries replayed before timing")
+    ap.add_argument("--out", default=None, help="results JSON (default ./runs/bench_<timestamp>.json)")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown before flagging")
+    args = ap.parse_args()
+
+    if args.mode in ("inproc", "both") and not args.index:
+        ap.error("--index is required for inproc benchmarks")
+
+    queries = read_topics(Path(args.topics), args.n, args.seed)
+    print(f"Replaying {len(queries)} queries from {args.topics}", flush=True)
+
+    results = {}
+    if args.mode in ("inproc", "both"):
+        results["inproc"] = bench_inproc(queries, args)
+        print(json.dumps(results["inproc"]["single"], indent=2), flush=True)
+    if args.mode in ("http", "both"):
+        results["http"] = bench_http(queries, args)
+        print(json.dumps(results["http"]["latency"], indent=2), flush=True)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "env": {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()},
+        "results": results,
+    }
+    out = Path(args.out or f"./runs/bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Results         : {out}", flush=True)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        print(f"Compared to     : {args.baseline}", flush=True)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {regressions}")
+
+if __name__ == "__main__":
+    main()
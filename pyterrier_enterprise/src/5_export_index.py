@@ -0,0 +1,23 @@
+import argparse
+from pathlib import Path
+
+from src.config import settings
+from src.indexing import init_java
+from src.npindex import BLOCK_POSTINGS, export
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Export the Terrier index to memory-mapped NumPy arrays (npindex) for "
+                    "pruned retrieval and for serving with SEARCH_ENGINE=numpy (no JVM).")
+    ap.add_argument("--index", default=settings.index_dir, help="index directory (INDEX_DIR)")
+    ap.add_argument("--block", type=int, default=BLOCK_POSTINGS, help="postings per block-max block")
+    args = ap.parse_args()
+
+    index_root = Path(args.index)
+    if not index_root.exists():
+        raise SystemExit(f"Missing index: {index_root}")
+    init_java()
+    export(index_root, block=args.block)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Checkpointed full builds that resume after a crash.
+
+With CHECKPOINT_FILES > 0 a full build indexes the corpus as a series of
+segments of at most that many files. Each segment is a complete Terrier
+index under INDEX_DIR/segments/, and the finished index lists the segments as
+components, as a sharded build lists its shards. After every segment,
+INDEX_DIR/build.json records the segments committed so far and the files
+they hold, in the usual manifest format. A restarted build reads it, drops
+any half-written segment, skips the files already indexed and carries on.
+manifest.json is only replaced once the whole corpus is done, so the
+previous index stays servable throughout. `--compact` folds the segments
+into a single base afterwards.
+
+build.json also lists the files of the segment in progress. If a run dies
+inside a segment, the next run retries those files as two half-size
+segments. A file that keeps crashing the indexer is thus isolated after a
+few restarts, then skipped and recorded under the manifest's "failed". An
+indexing error raised in Python is bisected the same way, without a restart,
+unless failures keep coming back to back for longer than bisecting one
+segment could take. That looks like a broken JVM rather than a bad file, so
+the build stops and the next run resumes with a fresh one.
+"""
+import itertools
+import os
+import shutil
+from collections import deque
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from src import incremental as inc
+from src.extract_cache import ExtractCache
+from src.indexing import index_docs, docs_for, make_deduper
+
+CHECKPOINT_NAME = "build.json"
+
+def load_checkpoint(index_root: Path) -> Optional[dict]:
+    return inc.load_json(Path(index_root) / CHECKPOINT_NAME)
+
+def _generation(index_root: Path) -> int:
+    """One more than any generation on disk, so a new build never touches
+    the segments of the index being served."""
+    seg_dir = Path(index_root) / inc.SEGMENT_DIR
+    gens = [int(p.name.split("-")[1]) for p in seg_dir.glob(inc.SEGMENT_PREFIX + "*")
+            if p.name.split("-")[1].isdigit()] if seg_dir.exists() else []
+    return max(gens, default=0) + 1
+
+def _sweep(index_root: Path, keep: set[str]) -> None:
+    """Remove segment directories that no manifest or checkpoint refers to."""
+    seg_dir = Path(index_root) / inc.SEGMENT_DIR
+    if not seg_dir.exists():
+        return
+    for p in seg_dir.iterdir():
+        if p.name not in keep:
+            shutil.rmtree(p, ignore_errors=True)
+
+def _batches(files: Iterable[Path], n: int) -> Iterator[list[str]]:
+    it = iter(files)
+    while batch := [str(fp) for fp in itertools.islice(it, n)]:
+        yield batch
+
+def _split(chunk: list[str], state: dict) -> list[list[str]]:
+    """Halves of a segment that failed; a single file is given up on."""
+    if len(chunk) > 1:
+        mid = len(chunk) // 2
+        return [chunk[:mid], chunk[mid:]]
+    path = chunk[0]
+    print(f"Skipping {path}: it keeps failing to index", flush=True)
+    try:
+        st = os.stat(path)
+        state["manifest"].setdefault("failed", {})[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    except OSError:
+        pass
+    return []
+
+def build_checkpointed(files: Iterable[Path], index_root: Path, cache: Optional[ExtractCache],
+                       segment_files: int, restart: bool = False) -> dict:
+    """Full build in checkpointed segments; returns the finished manifest
+    (the caller saves it). restart=True discards an earlier unfinished build."""
+    index_root = Path(index_root)
+    ckpt = index_root / CHECKPOINT_NAME
+    live = inc.load_manifest(index_root)
+    serving = set(live["components"]) if live else set()
+    state = None if restart else load_checkpoint(index_root)
+    if state is None:
+        manifest = inc.empty_manifest()
+        manifest["components"] = []
+        state = {"manifest": manifest, "generation": _generation(index_root), "next": 1,
+                 "pending": [], "inflight": None}
+    else:
+        print(f"Resuming build: {len(state['manifest']['components'])} segments, "
+              f"{len(state['manifest']['docs'])} files already indexed", flush=True)
+    manifest = state["manifest"]
+    _sweep(index_root, serving | set(manifest["components"]))
+    dedup = make_deduper()
+    if dedup is not None:
+        dedup.load(index_root, manifest)  # the segments committed so far
+
+    queue = deque(state["pending"])
+    if state["inflight"]:
+        # the previous run died inside this segment
+        queue.extendleft(reversed(_split(state["inflight"], state)))
+        state["inflight"] = None
+    skip = (set(manifest["docs"]) | set(manifest.get("failed", {})) | set(manifest.get("skipped", {}))
+            | {p for c in queue for p in c})
+    rest = _batches((fp for fp in files if str(fp) not in skip), segment_files)
+    failures, max_failures = 0, segment_files.bit_length() + 1
+
+    while True:
+        chunk = queue.popleft() if queue else next(rest, None)
+        if chunk is None:
+            break
+        name = f"{inc.SEGMENT_PREFIX}{state['generation']:04d}-{state['next']:04d}"
+        state["next"] += 1
+        state["inflight"], state["pending"] = chunk, list(queue)
+        inc.save_json(ckpt, state)
+
+        seg_root = inc.component_path(index_root, name)
+        seg_root.mkdir(parents=True, exist_ok=True)
+        part = inc.empty_manifest()
+        try:
+            index_docs(seg_root, inc.track(docs_for(map(Path, chunk), cache, dedup), part, name),
+                       label=name, total=len(chunk))
+        except KeyboardInterrupt:
+            # not a crash: retry the whole segment next time
+            state["inflight"], state["pending"] = None, [chunk] + list(queue)
+            inc.save_json(ckpt, state)
+            raise
+        except Exception as e:
+            shutil.rmtree(seg_root, ignore_errors=True)
+            if dedup is not None:
+                dedup.rollback()
+            failures += 1
+            if failures > max_failures:
+                raise  # build.json still names this segment; a restart bisects it
+            print(f"[{name}] indexing failed ({e}); retrying its {len(chunk)} files in halves", flush=True)
+            queue.extendleft(reversed(_split(chunk, state)))
+            state["inflight"] = None
+            continue
+
+        failures = 0
+        if dedup is not None:
+            dedup.commit(part, seg_root)
+            manifest.setdefault("skipped", {}).update(part.get("skipped", {}))
+        if part["docs"]:
+            manifest["docs"].update(part["docs"])
+            manifest["components"].append(name)
+        else:
+            shutil.rmtree(seg_root, ignore_errors=True)  # Terrier can't open an empty index
+        state["inflight"] = None
+        state["pending"] = list(queue)
+        if cache is not None:
+            cache.commit()  # a resumed run then skips re-extracting these files too
+        inc.save_json(ckpt, state)
+        print(f"[{name}] committed: {len(manifest['docs'])} files indexed so far", flush=True)
+
+    if not manifest["components"]:
+        raise SystemExit("Nothing was indexed; see the errors above.")
+    if dedup is not None:
+        print(dedup.summary(), flush=True)
+    return manifest
+
+def finish(index_root: Path, manifest: dict) -> None:
+    """Publish the finished build and clean up the previous generation."""
+    index_root = Path(index_root)
+    inc.save_manifest(index_root, manifest)
+    (index_root / CHECKPOINT_NAME).unlink(missing_ok=True)
+    _sweep(index_root, set(manifest["components"]))
@@ -10,7 +10,53 @@ class Settings:
     doc_dir: str = os.getenv("DOC_DIR", r"Z:\wccontainer\doc_urls")
     wiki_dir: str = os.getenv("WIKI_DIR", r"Z:\wccontainer\wiki_urls")
     index_dir: str = os.getenv("INDEX_DIR", r"Z:\wccontainer\terrier_index")
-    max_bytes_per_file: int = int(os.getenv("MAX_BYTES_PER_FILE", "10485760"))  # 10MB default; 0 means no limit
+    max_bytes_per_file: int = int(os.getenv("MAX_BYTES_PER_FILE", "0"))  # input size ceiling; 0 means no limit (files are streamed)
+    max_text_chars: int = int(os.getenv("MAX_TEXT_CHARS", "5000000"))  # extracted text kept per file; 0 means no cap
+    split_chars: int = int(os.getenv("SPLIT_CHARS", "0"))  # >0 splits longer documents into passages of this size
+    split_overlap_chars: int = int(os.getenv("SPLIT_OVERLAP_CHARS", "200"))  # text shared by consecutive passages
+    passage_words: int = int(os.getenv("PASSAGE_WORDS", "0"))  # >0 indexes every document as word windows (passage mode)
+    passage_stride_words: int = int(os.getenv("PASSAGE_STRIDE_WORDS", "0"))  # window step; 0 means PASSAGE_WORDS // 2
+    passage_agg: str = os.getenv("PASSAGE_AGG", "max")  # max (MaxP) | first (FirstP) when the index holds passages
+    passage_depth: int = int(os.getenv("PASSAGE_DEPTH", "3"))  # passages retrieved per requested document
+    index_heap_mb: int = int(os.getenv("INDEX_HEAP_MB", "2048"))  # JVM heap per indexing process
+    index_shards: int = int(os.getenv("INDEX_SHARDS", "1"))  # >1 builds hash-partitioned shards in parallel processes
+    checkpoint_files: int = int(os.getenv("CHECKPOINT_FILES", "0"))  # >0: full builds commit a resumable segment every N files
+    pruning_meta: bool = os.getenv("PRUNING_META", "0") == "1"  # export npindex (src/npindex.py) after every build
+    dedup: bool = os.getenv("DEDUP", "0") == "1"  # skip empty, duplicate and near-duplicate documents (src/dedup.py); qrels naming a skipped file then go unfound
+    dedup_threshold: float = float(os.getenv("DEDUP_THRESHOLD", "0.9"))  # estimated Jaccard similarity that counts as a near duplicate
+    dedup_skip_empty: bool = os.getenv("DEDUP_SKIP_EMPTY", "1") == "1"  # leave out documents with no extracted text
+    snippet_scan_chars: int = int(os.getenv("SNIPPET_SCAN_CHARS", "10000"))  # leading text kept per doc for snippets; 0 = none
+    progress_interval_s: float = float(os.getenv("PROGRESS_INTERVAL_S", "60"))  # build progress log period
+    extract_workers: int = int(os.getenv("EXTRACT_WORKERS", "1"))  # >1 enables the parallel Tika pool
+    extract_queue_depth: int = int(os.getenv("EXTRACT_QUEUE_DEPTH", "32"))  # max files in flight
+    extract_ordered: bool = os.getenv("EXTRACT_ORDERED", "1") == "1"
+    crawl_workers: int = int(os.getenv("CRAWL_WORKERS", "8"))  # directories listed / files stat'ed concurrently
+    prefetch_files: int = int(os.getenv("PREFETCH_FILES", "8"))  # files read ahead of parsing; 0 disables read-ahead
+    prefetch_mb: int = int(os.getenv("PREFETCH_MB", "256"))  # max file bytes held by the read-ahead buffer
+    prefetch_file_mb: int = int(os.getenv("PREFETCH_FILE_MB", "64"))  # larger files are streamed, not buffered
+    tika_servers: str = os.getenv("TIKA_SERVERS", "")  # comma-separated Tika server URLs; empty = tika-python's own server
+    extract_timeout_s: float = float(os.getenv("EXTRACT_TIMEOUT_S", "120"))  # per-file Tika timeout
+    extract_native: str = os.getenv("EXTRACT_NATIVE", "html,ooxml")  # formats parsed without Tika; empty sends all to Tika
+    extract_cache: str = os.getenv("EXTRACT_CACHE", "")  # sqlite path; empty disables the extraction cache
+    extract_cache_max_bytes: int = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", "0"))  # 0 means no size cap
+    extract_cache_max_age_days: float = float(os.getenv("EXTRACT_CACHE_MAX_AGE_DAYS", "0"))  # 0 means keep forever
+    search_batch_max: int = int(os.getenv("SEARCH_BATCH_MAX", "32"))  # max queries per transform call
+    search_batch_wait_ms: float = float(os.getenv("SEARCH_BATCH_WAIT_MS", "5"))  # how long a batch stays open
+    search_queue_max: int = int(os.getenv("SEARCH_QUEUE_MAX", "1024"))  # pending queries before 429
+    search_batch_request_max: int = int(os.getenv("SEARCH_BATCH_REQUEST_MAX", "10000"))  # queries per POST /search/batch
+    search_batch_chunk: int = int(os.getenv("SEARCH_BATCH_CHUNK", "500"))  # queries per transform call in /search/batch
+    server_heap_mb: int = int(os.getenv("SERVER_HEAP_MB", "2048"))
+    search_pruning: str = os.getenv("SEARCH_PRUNING", "")  # maxscore | blockmax; empty = exhaustive scoring
+    search_engine: str = os.getenv("SEARCH_ENGINE", "terrier")  # terrier | numpy (npindex export, no JVM)
+    npindex_cache_mb: int = int(os.getenv("NPINDEX_CACHE_MB", "64"))  # decoded postings kept per worker (numpy engine)
+    snippet_chars: int = int(os.getenv("SNIPPET_CHARS", "240"))  # max snippet length in /search hits
+    index_load_mode: str = os.getenv("INDEX_LOAD_MODE", "fileinmem")  # disk | fileinmem | memory
+    preload_index: bool = os.getenv("PRELOAD_INDEX", "1") == "1"  # open the index at startup, not first request
+    warmup_topics: str = os.getenv("WARMUP_TOPICS", "runs/topics.tsv")  # qid<TAB>query file; empty skips warm-up
+    warmup_count: int = int(os.getenv("WARMUP_COUNT", "20"))
+    result_cache_size: int = int(os.getenv("RESULT_CACHE_SIZE", "4096"))  # 0 disables the /search result cache
+    result_cache_ttl_s: float = float(os.getenv("RESULT_CACHE_TTL_S", "300"))  # 0 means no expiry
+    index_check_interval_s: float = float(os.getenv("INDEX_CHECK_INTERVAL_S", "5"))  # how often to look for a rebuilt index
     cors_allow_origins: list[str] | None = None
 
     def __post_init__(self):
@@ -0,0 +1,106 @@
+"""Corpus listing and read-ahead for network-mounted storage (e.g. rclone over Azure Blob).
+
+There, every directory listing, stat and open is a network round trip, and
+doing them one file at a time leaves the pipeline waiting on latency. This
+module keeps several of them in flight:
+
+  crawl()      walks a tree with a pool of threads, one scandir per directory,
+               keeping a few directories ahead of the consumer. Files come
+               out in a stable order (directories breadth-first, entries in
+               listing order).
+  stat_many()  stats a stream of paths on a pool, in input order.
+  read_ahead() runs fetch() for the next files on background threads while
+               the current one is parsed, bounded by a file count and by the
+               bytes the fetched results hold.
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+_END = object()
+
+def _list_dir(d: Path, suffixes: Optional[set[str]]) -> tuple[list[Path], list[Path]]:
+    files, dirs = [], []
+    try:
+        with os.scandir(d) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):  # like rglob: don't descend into linked trees
+                        dirs.append(Path(e.path))
+                    elif e.is_file() and (suffixes is None or os.path.splitext(e.name)[1].lower() in suffixes):
+                        files.append(Path(e.path))
+                except OSError:
+                    continue
+    except OSError:
+        pass  # unreadable directory: skipped, as rglob does
+    return files, dirs
+
+def crawl(root: Path, suffixes: Optional[set[str]] = None, workers: int = 8) -> Iterator[Path]:
+    """Files under root (with one of suffixes, lower-case, if given)."""
+    workers = max(workers, 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crawl") as pool:
+        todo = deque([Path(root)])
+        pending = deque()
+        while todo or pending:
+            # a bounded window, so a slow consumer doesn't hold the whole tree listing
+            while todo and len(pending) < 2 * workers:
+                pending.append(pool.submit(_list_dir, todo.popleft(), suffixes))
+            files, dirs = pending.popleft().result()
+            todo.extend(dirs)
+            yield from files
+
+def _stat(p: Path) -> Optional[os.stat_result]:
+    try:
+        return p.stat()
+    except OSError:
+        return None
+
+def stat_many(paths: Iterable[Path], workers: int = 8, batch: int = 256) -> Iterator[tuple[Path, Optional[os.stat_result]]]:
+    """(path, stat or None if it vanished) for each path, batch by batch on a pool."""
+    if workers <= 1:
+        for p in paths:
+            yield p, _stat(p)
+        return
+    it = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stat") as pool:
+        while chunk := [p for _, p in zip(range(batch), it)]:
+            yield from zip(chunk, pool.map(_stat, chunk))
+
+def read_ahead(items: Iterable, fetch: Callable[..., T], depth: int = 8, max_bytes: int = 256 << 20,
+               size: Callable[[T], int] = lambda r: 0) -> Iterator[T]:
+    """fetch(item) for each item, in order, with up to `depth` fetches running
+    ahead on background threads. No new fetch starts while the results
+    waiting to be consumed hold max_bytes or more (as measured by size())."""
+    if depth <= 0:
+        yield from map(fetch, items)
+        return
+    it = iter(items)
+    held = [0]
+    lock = threading.Lock()
+
+    def _run(item):
+        out = fetch(item)
+        with lock:
+            held[0] += size(out)
+        return out
+
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix="readahead") as pool:
+        pending = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < depth and (held[0] < max_bytes or not pending):
+                item = next(it, _END)
+                if item is _END:
+                    exhausted = True
+                    break
+                pending.append(pool.submit(_run, item))
+            if not pending:
+                return
+            out = pending.popleft().result()
+            with lock:
+                held[0] -= size(out)
+            yield out
@@ -0,0 +1,216 @@
+"""Skipping empty, duplicate and near-duplicate documents at index time.
+
+Deduper sits between extraction and the indexer (docs_for). It checks each
+document against those kept so far:
+
+  empty  no words in the extracted text;
+  exact  same words as a kept document (title included; case, punctuation
+         and spacing ignored), by SHA-1;
+  near   estimated Jaccard similarity of the 5-word shingles to a kept
+         document >= threshold. MinHash signatures (128 hashes) are bucketed
+         by LSH (16 bands of 8 rows), so each document is compared with only
+         a handful of candidates.
+
+Only the first document of each cluster (its representative) is indexed.
+The others are recorded in the manifest under "skipped" as
+path -> {size, mtime_ns, kind, of, sim}, so delta builds leave them alone
+until they change. If a representative changes or disappears, its
+duplicates are re-indexed (release()). Each component stores the signatures
+of the documents it holds (minhash.npy/minhash.json), so delta builds are
+checked against the documents already indexed. cluster_table() groups the
+skipped entries by representative for /search and duplicates.tsv.
+"""
+import hashlib
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+
+from src import incremental as inc
+
+SHINGLE_WORDS = 5
+PERMS = 128
+BANDS = 16
+MIN_NEAR_WORDS = 30  # shorter documents are only matched exactly
+SIG_NAME = "minhash"
+TABLE_NAME = "duplicates.tsv"
+_WORD = re.compile(r"\w+")
+_rng = np.random.default_rng(20240611)  # fixed: signatures must compare across builds
+_A = _rng.integers(1, 1 << 63, PERMS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 1 << 63, PERMS, dtype=np.uint64)
+_MIX = _rng.integers(1, 1 << 63, (SHINGLE_WORDS,), dtype=np.uint64) | np.uint64(1)
+_BAND_MIX = _rng.integers(1, 1 << 63, PERMS // BANDS, dtype=np.uint64) | np.uint64(1)
+
+def words(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+def shingles(tokens: list[str]) -> np.ndarray:
+    """32-bit hashes of the distinct SHINGLE_WORDS-word shingles."""
+    h = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.uint64, count=len(tokens))
+    n = max(len(h) - SHINGLE_WORDS + 1, 1)
+    acc = np.zeros(n, dtype=np.uint64)
+    for j in range(min(SHINGLE_WORDS, len(h))):
+        acc += h[j:j + n] * _MIX[j]  # wraps mod 2^64
+    return np.unique((acc >> np.uint64(32)) ^ (acc & np.uint64(0xFFFFFFFF)))
+
+def minhash(hashes: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """PERMS minimum hash values, by multiply-shift hashing ((a*x + b) mod 2^64) >> 32."""
+    sig = np.full(PERMS, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for s in range(0, len(hashes), chunk):
+        x = hashes[s:s + chunk]
+        vals = (_A[:, None] * x[None, :] + _B[:, None]) >> np.uint64(32)
+        np.minimum(sig, vals.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+def band_keys(sig: np.ndarray) -> list[int]:
+    rows = sig.reshape(BANDS, -1).astype(np.uint64)
+    return [int(k) for k in (rows * _BAND_MIX).sum(axis=1)]
+
+class Deduper:
+    """Streaming duplicate check. filter() passes on the documents to index;
+    commit() records what it skipped and stores the signatures of what it kept."""
+
+    def __init__(self, threshold: float = 0.9, skip_empty: bool = True):
+        self.threshold = threshold
+        self.skip_empty = skip_empty
+        self.sigs = np.zeros((1024, PERMS), dtype=np.uint32)  # grown by doubling
+        self.paths: list[str] = []
+        self.digests: list[str] = []
+        self.alive: list[bool] = []
+        self.exact: dict[str, int] = {}
+        self.buckets: list[dict[int, list[int]]] = [{} for _ in range(BANDS)]
+        self._first_new = 0  # first representative added since the last commit
+        self.skipped: dict[str, dict] = {}
+        self.counts = {"kept": 0, "empty": 0, "exact": 0, "near": 0}
+
+    def _add(self, path: str, digest: str, sig: Optional[np.ndarray]) -> None:
+        i = len(self.paths)
+        self.paths.append(path)
+        self.digests.append(digest)
+        self.alive.append(True)
+        j = self.exact.get(digest)
+        if j is None or not self.alive[j]:
+            self.exact[digest] = i
+        if i == len(self.sigs):
+            self.sigs = np.vstack([self.sigs, np.zeros_like(self.sigs)])
+        if sig is None:
+            self.sigs[i] = 0  # too short for near matching
+        else:
+            self.sigs[i] = sig
+            for band, key in zip(self.buckets, band_keys(sig)):
+                band.setdefault(key, []).append(i)
+
+    def load(self, index_root: Path, manifest: dict, exclude: Iterable[str] = ()) -> None:
+        """Signatures of the documents the manifest says are live, except `exclude`."""
+        exclude = set(exclude)
+        docs = manifest["docs"]
+        for name in manifest["components"]:
+            root = inc.component_path(index_root, name)
+            info = inc.load_json(root / f"{SIG_NAME}.json")
+            if info is None:
+                continue
+            sigs = np.load(root / f"{SIG_NAME}.npy")
+            for path, digest, near, sig in zip(info["paths"], info["sha1"], info["near"], sigs):
+                entry = docs.get(path)
+                if entry is not None and entry["index"] == name and path not in exclude:
+                    self._add(path, digest, sig if near else None)
+        self._first_new = len(self.paths)
+
+    def check(self, doc: Dict) -> tuple[Optional[dict], str, Optional[np.ndarray]]:
+        """(skip entry or None, digest, signature or None) for one document."""
+        tokens = words(doc.get("text") or "")
+        if not tokens and self.skip_empty:
+            return {"kind": "empty"}, "", None
+        digest = hashlib.sha1(" ".join(words(doc.get("title") or "") + tokens).encode("utf-8")).hexdigest()
+        i = self.exact.get(digest)
+        if i is not None and self.alive[i]:
+            return {"kind": "exact", "of": self.paths[i], "sim": 1.0}, digest, None
+        if len(tokens) < MIN_NEAR_WORDS:
+            return None, digest, None
+        sig = minhash(shingles(tokens))
+        cands = {i for band, key in zip(self.buckets, band_keys(sig)) for i in band.get(key, ())}
+        best, best_sim = None, 0.0
+        for i in cands:
+            if self.alive[i]:
+                sim = float(np.mean(self.sigs[i] == sig))
+                if sim > best_sim:
+                    best, best_sim = i, sim
+        if best is not None and best_sim >= self.threshold:
+            return {"kind": "near", "of": self.paths[best], "sim": round(best_sim, 3)}, digest, sig
+        return None, digest, sig
+
+    def filter(self, docs: Iterable[Dict]) -> Iterator[Dict]:
+        for doc in docs:
+            skip, digest, sig = self.check(doc)
+            if skip is None:
+                self._add(doc["path"], digest, sig)
+                self.counts["kept"] += 1
+                yield doc
+                continue
+            self.counts[skip["kind"]] += 1
+            if "mtime_ns" in doc:
+                skip = {"size": doc["size"], "mtime_ns": doc["mtime_ns"], **skip}
+            self.skipped[doc["path"]] = skip
+
+    def commit(self, manifest: dict, component_dir: Optional[Path]) -> None:
+        """Record the skipped files in the manifest (an indexed older version
+        goes dead) and store the kept documents' signatures in component_dir."""
+        for path, skip in self.skipped.items():
+            if "size" not in skip:
+                try:
+                    st = Path(path).stat()
+                except OSError:
+                    continue
+                skip = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, **skip}
+            inc.mark_deleted(manifest, [path])
+            manifest.setdefault("skipped", {})[path] = skip
+        new = range(self._first_new, len(self.paths))
+        if component_dir is not None:
+            sigs = self.sigs[new.start:new.stop]
+            np.save(Path(component_dir) / f"{SIG_NAME}.npy", sigs)
+            inc.save_json(Path(component_dir) / f"{SIG_NAME}.json", {
+                "paths": [self.paths[i] for i in new], "sha1": [self.digests[i] for i in new],
+                "near": [bool(s.any()) for s in sigs]})
+        self.skipped = {}
+        self._first_new = len(self.paths)
+
+    def rollback(self) -> None:
+        """Forget what was seen since the last commit (its segment failed to index)."""
+        for i in range(self._first_new, len(self.paths)):
+            self.alive[i] = False
+        self.skipped = {}
+        self._first_new = len(self.paths)
+
+    def summary(self) -> str:
+        c = self.counts
+        return f"Dedup: kept {c['kept']}, skipped {c['exact']} exact and {c['near']} near duplicates, {c['empty']} empty"
+
+def release(manifest: dict, paths: Iterable[str]) -> list[Path]:
+    """Un-skip the duplicates of representatives that changed or vanished;
+    returns them for re-indexing."""
+    gone = set(paths)
+    skipped = manifest.get("skipped", {})
+    out = [p for p, e in skipped.items() if e.get("of") in gone and p not in gone]
+    for p in out:
+        del skipped[p]
+    return [Path(p) for p in out]
+
+def cluster_table(manifest: Optional[dict]) -> dict[str, list[str]]:
+    """Representative path -> paths of its skipped duplicates."""
+    out: dict[str, list[str]] = {}
+    for path, e in (manifest or {}).get("skipped", {}).items():
+        if e.get("of"):
+            out.setdefault(e["of"], []).append(path)
+    return out
+
+def write_table(index_root: Path, manifest: dict) -> Path:
+    """INDEX_DIR/duplicates.tsv: representative, duplicate, kind, similarity."""
+    out = Path(index_root) / TABLE_NAME
+    rows = sorted((e.get("of", ""), p, e["kind"], e.get("sim", "")) for p, e in manifest.get("skipped", {}).items())
+    with open(out, "w", encoding="utf-8") as f:
+        f.write("representative\tduplicate\tkind\tsimilarity\n")
+        for row in rows:
+            f.write("\t".join(map(str, row)) + "\n")
+    return out
@@ -0,0 +1,123 @@
+"""Compressed, memory-mapped document store keyed by Terrier docid.
+
+Written alongside each index component while indexing, so the Terrier meta
+index only has to hold short fields. Records are grouped into blocks of
+BLOCK_DOCS documents, and each block is stored as zlib-compressed JSON. The
+offsets array (int64, n_blocks + 1 entries) gives each block's byte range.
+The reader memory-maps both files and decompresses one block per lookup,
+keeping a few recently used blocks cached. The same format, under another
+directory name, holds the snippet sources (see snippets.py).
+
+    docstore/data.bin      concatenated compressed blocks
+    docstore/offsets.npy   block start offsets
+"""
+import json
+import mmap
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, Dict, Optional
+
+import numpy as np
+
+DOCSTORE_DIR = "docstore"
+BLOCK_DOCS = 32
+STORED_FIELDS = ("path", "title", "content")
+
+class DocStoreWriter:
+    def __init__(self, index_dir: Path, name: str = DOCSTORE_DIR):
+        self.root = Path(index_dir) / name
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.root / "data.bin", "wb")
+        self._offsets = [0]
+        self._block: list[dict] = []
+        self.count = 0
+
+    def add(self, doc: Dict) -> None:
+        # the stored body is the text that was indexed
+        self.add_record({"path": doc.get("path", ""), "title": doc.get("title", ""), "content": doc.get("text", "")})
+
+    def add_record(self, rec: Dict) -> None:
+        self._block.append(rec)
+        self.count += 1
+        if len(self._block) >= BLOCK_DOCS:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._block:
+            return
+        raw = json.dumps(self._block, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._fh.write(zlib.compress(raw, 6))
+        self._offsets.append(self._fh.tell())
+        self._block = []
+
+    def wrap(self, docs: Iterable[Dict]) -> Iterator[Dict]:
+        """Store each doc in yield order (= Terrier docid order) and pass it on."""
+        for doc in docs:
+            self.add(doc)
+            yield doc
+
+    def close(self) -> None:
+        self._flush()
+        self._fh.close()
+        np.save(self.root / "offsets.npy", np.asarray(self._offsets, dtype=np.int64))
+
+class DocStore:
+    def __init__(self, index_dir: Path, cache_blocks: int = 64, name: str = DOCSTORE_DIR):
+        root = Path(index_dir) / name
+        self.offsets = np.load(root / "offsets.npy", mmap_mode="r")
+        self._fh = open(root / "data.bin", "rb")
+        size = int(self.offsets[-1])
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._cache: OrderedDict[int, list] = OrderedDict()
+        self._cache_blocks = cache_blocks
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def open(index_dir: Path, name: str = DOCSTORE_DIR) -> Optional["DocStore"]:
+        if not (Path(index_dir) / name / "offsets.npy").exists():
+            return None
+        return DocStore(index_dir, name=name)
+
+    def __len__(self) -> int:
+        return (len(self.offsets) - 1) * BLOCK_DOCS  # upper bound; last block may be short
+
+    def _block(self, b: int) -> list:
+        with self._lock:
+            blk = self._cache.get(b)
+            if blk is not None:
+                self._cache.move_to_end(b)
+                return blk
+        start, end = int(self.offsets[b]), int(self.offsets[b + 1])
+        blk = json.loads(zlib.decompress(self._mm[start:end]).decode("utf-8"))
+        with self._lock:
+            self._cache[b] = blk
+            if len(self._cache) > self._cache_blocks:
+                self._cache.popitem(last=False)
+        return blk
+
+    def get(self, docid: int) -> Optional[dict]:
+        b, i = divmod(int(docid), BLOCK_DOCS)
+        if b >= len(self.offsets) - 1:
+            return None
+        blk = self._block(b)
+        return blk[i] if i < len(blk) else None
+
+    def get_many(self, docids) -> list[Optional[dict]]:
+        """Records for many docids, decoding each touched block once."""
+        n_blocks = len(self.offsets) - 1
+        blocks: dict[int, list] = {}
+        out = []
+        for d in docids:
+            b, i = divmod(int(d), BLOCK_DOCS)
+            blk = blocks.get(b)
+            if blk is None:
+                blk = blocks[b] = self._block(b) if b < n_blocks else []
+            out.append(blk[i] if i < len(blk) else None)
+        return out
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._fh.close()
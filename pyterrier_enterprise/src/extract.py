@@ -1,9 +1,16 @@
 from pathlib import Path
 from datetime import datetime
-from typing import Iterator, Dict, Optional
+from typing import Iterable, Iterator, Dict, NamedTuple, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import io
 import os
+import time
 
-from tika import parser as tika_parser  # downloads/starts Tika server on first use
+from src.corpus import crawl, read_ahead
+from src.extract_cache import ExtractCache, stream_hash
+from src.extractors import Extractor
+from src.metrics import READ_SECONDS, READ_BYTES
 
 # File types we’ll attempt to parse
 ALLOWED_SUFFIXES = {
@@ -11,54 +18,219 @@ ALLOWED_SUFFIXES = {
     ".html", ".htm"
 }
 
-def safe_read_bytes(path: Path, max_bytes: int) -> Optional[bytes]:
+class TimedReader:
+    """Binary file wrapper that adds up time spent in read() and bytes read,
+    so streamed extraction still feeds the read metrics. It exposes fileno()
+    and tell(), which lets requests send a Content-Length for uploads."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self.seconds = 0.0
+        self.nbytes = 0
+
+    def read(self, n: int = -1) -> bytes:
+        t0 = time.perf_counter()
+        data = self._fh.read(n)
+        self.seconds += time.perf_counter() - t0
+        self.nbytes += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._fh.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._fh.tell()
+
+    def fileno(self) -> int:
+        return self._fh.fileno()
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self._fh.close()
+        READ_SECONDS.observe(self.seconds)
+        READ_BYTES.inc(self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_source(path: Path, max_bytes: int) -> Optional[TimedReader]:
+    """Open a corpus file for streamed reading; None if unreadable or over
+    max_bytes (0 = no input limit; extracted text is capped separately)."""
     try:
         if max_bytes and path.stat().st_size > max_bytes:
             return None
-        with open(path, "rb") as fh:
-            return fh.read()
-    except Exception:
+        return TimedReader(open(path, "rb", buffering=1 << 20))
+    except OSError:
         return None
 
-def parse_file(path: Path, max_bytes: int) -> dict:
-    """Return {content, metadata} using Tika; empty content on failure."""
-    raw = safe_read_bytes(path, max_bytes)
-    if raw is None:
-        return {"content": "", "metadata": {"X-Parser-Note": "Skipped (size limit)"}}
+class Fetched(NamedTuple):
+    """A file as read ahead of parsing: its stat, and either its bytes, a
+    cached extraction (hit), or neither (too big to buffer, or unreadable)."""
+    path: Path
+    st: Optional[os.stat_result]
+    data: Optional[bytes] = None
+    hit: Optional[dict] = None
+
+def fetch_file(fp: Path, max_bytes: int, cache: Optional[ExtractCache] = None,
+               buffer_max: int = 64 << 20, extractor: Optional[Extractor] = None) -> Fetched:
+    """Stat fp and, unless the cache already has it, read it into memory
+    (files over buffer_max are left for the parser to stream)."""
     try:
-        # tika_parser.from_buffer avoids path/URI issues on Windows
-        out = tika_parser.from_buffer(raw)
-        content = (out.get("content") or "").strip()
-        meta = out.get("metadata") or {}
-        return {"content": content, "metadata": meta}
-    except Exception as e:
-        return {"content": "", "metadata": {"X-Parser-Error": str(e)}}
-
-def iter_docs(root: Path, max_bytes: int) -> Iterator[Dict]:
-    """Yield PyTerrier-acceptable dicts from files under root."""
-    for fp in root.rglob("*"):
-        if not fp.is_file():
-            continue
-        if fp.suffix.lower() not in ALLOWED_SUFFIXES:
-            continue
-
-        parsed = parse_file(fp, max_bytes)
-        content = parsed.get("content", "")
-        meta = parsed.get("metadata", {}) or {}
-
-        # Basic title guess
-        title = meta.get("title") or fp.stem
-        ctype = meta.get("Content-Type") or meta.get("Content-type") or ""
-        mtime = datetime.fromtimestamp(fp.stat().st_mtime).isoformat(timespec="seconds")
-
-        # PyTerrier doc fields
-        yield {
-            "docno": str(fp),           # unique ID = absolute path
-            "path": str(fp),
-            "title": title,
-            "text": content,            # <-- add this line
-            "content": content,         # optional: keep full body as meta too
-            "content_type": ctype,
-            "modified": mtime,
-        }
+        st = fp.stat()
+    except OSError:
+        return Fetched(fp, None)
+    if cache is not None:
+        hit = cache.get(str(fp), st.st_size, st.st_mtime_ns, (extractor or default_extractor()).fingerprint)
+        if hit is not None:
+            return Fetched(fp, st, hit=hit)
+    if st.st_size > buffer_max or (max_bytes and st.st_size > max_bytes):
+        return Fetched(fp, st)
+    src = open_source(fp, 0)
+    if src is None:
+        return Fetched(fp, st)
+    try:
+        with src:
+            return Fetched(fp, st, data=src.read())
+    except OSError:
+        return Fetched(fp, st)  # unreadable now: the parser retries and reports it
+
+_default_extractor: Optional[Extractor] = None
+
+def default_extractor() -> Extractor:
+    """Native paths on, tika-python's managed server for the rest, no text cap."""
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = Extractor()
+    return _default_extractor
+
+def parse_file(path: Path, max_bytes: int, cache: Optional[ExtractCache] = None,
+               extractor: Optional[Extractor] = None, fetched: Optional[Fetched] = None) -> dict:
+    """Return {content, metadata} via the extractor (native or Tika); empty
+    content on failure.
+
+    With a cache, unchanged files (same path, size, mtime) skip both the read
+    and Tika; files whose bytes match a cached entry skip Tika. Either way the
+    entry must come from an extractor with the same fingerprint. fetched (from
+    fetch_file) supplies the stat, cache hit and bytes read ahead.
+    """
+    if fetched is not None and fetched.hit is not None:
+        return fetched.hit
+    st = fetched.st if fetched is not None else None
+    extractor = extractor or default_extractor()
+    key = None
+    if cache is not None:
+        try:
+            st = st or path.stat()
+            key = (str(path), st.st_size, st.st_mtime_ns, extractor.fingerprint)
+        except OSError:
+            key = None
+        if key is not None and fetched is None:
+            hit = cache.get(*key)
+            if hit is not None:
+                return hit
+    if fetched is not None and fetched.data is not None:
+        src = io.BytesIO(fetched.data)
+    else:
+        src = open_source(path, max_bytes)
+    if src is None:
+        return {"content": "", "metadata": {"X-Parser-Note": "Skipped (size limit or unreadable)"}}
+    with src:
+        sha1 = None
+        if key is not None:
+            try:
+                sha1 = stream_hash(src)
+                src.seek(0)
+            except OSError as e:
+                return {"content": "", "metadata": {"X-Parser-Error": str(e)}}
+            hit = cache.get_by_hash(*key, sha1)
+            if hit is not None:
+                return hit
+        try:
+            parsed = extractor.extract(src, path.suffix)
+        except Exception as e:
+            # not cached: Tika errors and timeouts are often transient
+            return {"content": "", "metadata": {"X-Parser-Error": str(e)}}
+    if key is not None:
+        cache.put(*key, sha1, parsed)
+    return parsed
+
+def iter_files(root: Path, workers: int = 1) -> Iterator[Path]:
+    """Yield parseable files under root, listing up to `workers` directories at once."""
+    return crawl(root, ALLOWED_SUFFIXES, workers)
+
+def to_doc(fp: Path, parsed: dict, st: Optional[os.stat_result] = None) -> Dict:
+    """Turn a parse_file() result into a PyTerrier doc dict. size/mtime_ns
+    are only read by the manifest (incremental.track), not indexed."""
+    content = parsed.get("content", "")
+    meta = parsed.get("metadata", {}) or {}
+
+    # Basic title guess
+    title = meta.get("title") or fp.stem
+    ctype = meta.get("Content-Type") or meta.get("Content-type") or ""
+    st = st or fp.stat()
+    mtime = datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds")
+
+    # PyTerrier doc fields
+    return {
+        "docno": str(fp),           # unique ID = absolute path
+        "path": str(fp),
+        "title": title,
+        "text": content,            # indexed, and stored as the docstore's content
+        "content_type": ctype,
+        "modified": mtime,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+def _load_doc(fp: Path | Fetched, max_bytes: int, cache: Optional[ExtractCache] = None,
+              extractor: Optional[Extractor] = None) -> Dict:
+    if isinstance(fp, Fetched):
+        return to_doc(fp.path, parse_file(fp.path, max_bytes, cache, extractor, fp), fp.st)
+    return to_doc(fp, parse_file(fp, max_bytes, cache, extractor))
+
+def load_docs(files: Iterable[Path], max_bytes: int, cache: Optional[ExtractCache] = None,
+              workers: int = 1, queue_depth: int = 32, ordered: bool = True,
+              extractor: Optional[Extractor] = None, prefetch: int = 0,
+              prefetch_bytes: int = 256 << 20, prefetch_file_bytes: int = 64 << 20) -> Iterator[Dict]:
+    """Parse an explicit file list into PyTerrier doc dicts.
+
+    With workers > 1, up to `queue_depth` files are in flight across that
+    many threads. Tika parsing happens server-side over HTTP and the native
+    parsers are mostly C-level zlib/expat work, so threads are enough to
+    overlap it. Reading the file list stops while the window is full, so
+    memory stays bounded even if the indexer consumes slowly.
 
+    prefetch > 0 stats and reads that many files ahead of the parsers on
+    background threads, holding at most prefetch_bytes of file bodies.
+    Files over prefetch_file_bytes are only stat'ed and then streamed."""
+    if prefetch > 0:
+        files = read_ahead(files, lambda fp: fetch_file(fp, max_bytes, cache, prefetch_file_bytes, extractor),
+                           prefetch, prefetch_bytes, size=lambda f: len(f.data or b""))
+    if workers <= 1:
+        for fp in files:
+            yield _load_doc(fp, max_bytes, cache, extractor)
+        return
+    queue_depth = max(queue_depth, workers, 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as pool:
+        pending = deque()
+        for fp in files:
+            pending.append(pool.submit(_load_doc, fp, max_bytes, cache, extractor))
+            if len(pending) < queue_depth:
+                continue
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    pending.remove(fut)
+                    yield fut.result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extracts (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1     TEXT NOT NULL,
+    blob     BLOB NOT NULL,
+    nbytes   INTEGER NOT NULL,
+    used_at  REAL NOT NULL,
+    config   TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS extracts_sha1 ON extracts(sha1);
+CREATE INDEX IF NOT EXISTS extracts_used ON extracts(used_at);
+"""
+_COLUMNS = "path, size, mtime_ns, sha1, blob, nbytes, used_at, config"
+
+def stream_hash(fh, chunk_bytes: int = 1 << 20) -> str:
+    """sha1 of a binary file read in chunks, from its current position."""
+    h = hashlib.sha1()
+    for chunk in iter(lambda: fh.read(chunk_bytes), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+class ExtractCache:
+    """SQLite cache of parse_file() results.
+
+    Lookups go by (path, size, mtime) first; on a miss the caller can retry by
+    content hash, which catches files that were touched or copied without
+    changing. Both only match entries extracted with the same extractor
+    settings (`config`, see Extractor.fingerprint). Values are
+    zlib-compressed JSON of {content, metadata}.
+    """
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(extracts)")}
+        if "config" not in cols:
+            # caches from before the column: their entries never match a fingerprint
+            self._conn.execute("ALTER TABLE extracts ADD COLUMN config TEXT NOT NULL DEFAULT ''")
+        self.hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._uncommitted = 0
+
+    @staticmethod
+    def _encode(parsed: dict) -> bytes:
+        return zlib.compress(json.dumps(parsed, ensure_ascii=False).encode("utf-8"), 6)
+
+    @staticmethod
+    def _decode(blob: bytes) -> dict:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def get(self, path: str, size: int, mtime_ns: int, config: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob FROM extracts WHERE path=? AND size=? AND mtime_ns=? AND config=?",
+                (path, size, mtime_ns, config),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE extracts SET used_at=? WHERE path=?", (time.time(), path))
+            self.hits += 1
+        return self._decode(row[0])
+
+    def get_by_hash(self, path: str, size: int, mtime_ns: int, config: str, sha1: str) -> Optional[dict]:
+        """Fallback lookup by content hash; re-keys the entry under `path`."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob, nbytes FROM extracts WHERE sha1=? AND config=? LIMIT 1", (sha1, config)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO extracts ({_COLUMNS}) VALUES (?,?,?,?,?,?,?,?)",
+                (path, size, mtime_ns, sha1, row[0], row[1], time.time(), config),
+            )
+            self.hash_hits += 1
+        return self._decode(row[0])
+
+    def put(self, path: str, size: int, mtime_ns: int, config: str, sha1: str, parsed: dict) -> None:
+        blob = self._encode(parsed)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO extracts ({_COLUMNS}) VALUES (?,?,?,?,?,?,?,?)",
+                (path, size, mtime_ns, sha1, blob, len(blob), time.time(), config),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= 200:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def evict(self, max_bytes: int = 0, max_age_days: float = 0) -> int:
+        """Drop entries unused for max_age_days, then least-recently-used ones
+        until the stored blobs fit in max_bytes. 0 disables either limit."""
+        removed = 0
+        with self._lock:
+            if max_age_days:
+                cutoff = time.time() - max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM extracts WHERE used_at < ?", (cutoff,)).rowcount
+            if max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM extracts").fetchone()[0]
+                if total > max_bytes:
+                    # walk LRU order and find the used_at cutoff that frees enough
+                    excess, cutoff = total - max_bytes, None
+                    for used_at, nbytes in self._conn.execute(
+                        "SELECT used_at, nbytes FROM extracts ORDER BY used_at"
+                    ):
+                        excess -= nbytes
+                        cutoff = used_at
+                        if excess <= 0:
+                            break
+                    if cutoff is not None:
+                        removed += self._conn.execute(
+                            "DELETE FROM extracts WHERE used_at <= ?", (cutoff,)
+                        ).rowcount
+            self._conn.commit()
+        self.evicted += removed
+        return removed
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM extracts"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "entries": entries,
+            "bytes": nbytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
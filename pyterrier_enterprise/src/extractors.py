@@ -0,0 +1,312 @@
+"""Text extraction backends behind parse_file().
+
+HTML and OOXML (docx/pptx/xlsx) are parsed natively with the standard
+library. HTML is the whole wiki dump, so most files never reach Tika.
+Everything else, plus any native parse that fails, goes to Tika. That is
+either a pool of Tika servers you run yourself
+(`java -jar tika-server.jar -p 9998`, one per port) reached over keep-alive
+connections, or tika-python's own managed server when TIKA_SERVERS is empty.
+Every Tika call has a timeout, so one pathological file can't stall the
+indexer.
+
+Files arrive as open binary streams and are read in chunks (streamed to
+Tika, fed incrementally to the HTML parser, opened in place as zips), so a
+large manual never sits in memory whole. Extracted text is capped at
+max_chars instead.
+"""
+import codecs
+import itertools
+import re
+import threading
+import time
+import zipfile
+from html.parser import HTMLParser
+from io import BytesIO
+from typing import BinaryIO, Iterator, Optional
+from xml.etree import ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.metrics import TIKA_SECONDS, NATIVE_SECONDS
+
+HTML_SUFFIXES = {".html", ".htm"}
+OOXML_SUFFIXES = {".docx", ".pptx", ".xlsx"}
+NATIVE_KINDS = {"html", "ooxml"}
+
+OOXML_TYPES = {
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_S = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_DC_TITLE = "{http://purl.org/dc/elements/1.1/}title"
+
+class ExtractError(Exception):
+    """A backend could not extract text (timeout, server down, corrupt file)."""
+
+# --- HTML -------------------------------------------------------------------
+
+_SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6",
+               "section", "article", "table", "ul", "ol", "pre", "blockquote", "dd", "dt"}
+_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+_BLANKS = re.compile(r"[ \t\r\f\v]+")
+_NEWLINES = re.compile(r"\n\s*\n+")
+
+class _HTMLText(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.title: list[str] = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title.append(data)
+        elif not self._skip:
+            self.parts.append(data)
+
+CHUNK_BYTES = 1 << 20  # read size for streamed parsing
+
+def _sniff_encoding(head: bytes) -> str:
+    if head.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    m = _CHARSET.search(head[:4096])
+    enc = m.group(1).decode("ascii", errors="ignore") if m else "utf-8"
+    try:
+        codecs.lookup(enc)
+    except LookupError:
+        enc = "utf-8"
+    return enc
+
+def _tidy(text: str) -> str:
+    text = _BLANKS.sub(" ", text)
+    return _NEWLINES.sub("\n\n", "\n".join(line.strip() for line in text.split("\n"))).strip()
+
+def extract_html(src: BinaryIO, max_chars: int = 0) -> dict:
+    """Feed the file to the parser a chunk at a time; stop once max_chars of
+    text have been collected."""
+    p = _HTMLText()
+    chunk = src.read(CHUNK_BYTES)
+    decoder = codecs.getincrementaldecoder(_sniff_encoding(chunk))(errors="replace")
+    collected = 0
+    truncated = False
+    while chunk:
+        n = len(p.parts)
+        p.feed(decoder.decode(chunk))
+        collected += sum(len(t) for t in p.parts[n:])
+        if max_chars and collected >= max_chars:
+            truncated = True
+            break
+        chunk = src.read(CHUNK_BYTES)
+    else:
+        p.feed(decoder.decode(b"", final=True))
+        p.close()
+    meta = {"Content-Type": "text/html", "X-Parser": "native-html"}
+    title = " ".join("".join(p.title).split())
+    if title:
+        meta["title"] = title
+    if truncated:
+        meta["X-Text-Truncated"] = "true"
+    return {"content": _tidy("".join(p.parts)), "metadata": meta}
+
+# --- OOXML ------------------------------------------------------------------
+
+def _xml_paras(zf: zipfile.ZipFile, name: str, text_tag: str, para_tag: str) -> Iterator[str]:
+    """Paragraph texts of one XML part, parsed incrementally."""
+    with zf.open(name) as fh:
+        for _, el in ET.iterparse(fh, events=("end",)):
+            if el.tag == para_tag:
+                line = "".join(t.text or "" for t in el.iter(text_tag))
+                el.clear()
+                if line:
+                    yield line
+
+def _part_number(name: str) -> int:
+    m = re.search(r"(\d+)\.xml$", name)
+    return int(m.group(1)) if m else 0
+
+def extract_ooxml(src: BinaryIO, suffix: str, max_chars: int = 0) -> dict:
+    """Text of a docx/pptx/xlsx. The zip is read through the seekable file, so
+    only the parts we need are inflated, and reading stops at max_chars."""
+    with zipfile.ZipFile(src) as zf:
+        names = set(zf.namelist())
+        if suffix == ".docx":
+            parts = ["word/document.xml"] + sorted(
+                (n for n in names if re.match(r"word/(header|footer|footnotes|endnotes)\d*\.xml$", n)),
+                key=_part_number)
+            tags = (f"{_W}t", f"{_W}p")
+        elif suffix == ".pptx":
+            parts = sorted((n for n in names if re.match(r"ppt/(slides/slide|notesSlides/notesSlide)\d+\.xml$", n)),
+                           key=lambda n: (_part_number(n), "notes" in n))
+            tags = (f"{_A}t", f"{_A}p")
+        else:  # .xlsx: cell text lives in the shared-string table
+            parts = ["xl/sharedStrings.xml"]
+            tags = (f"{_S}t", f"{_S}si")
+        meta = {"Content-Type": OOXML_TYPES[suffix], "X-Parser": "native-ooxml"}
+        paras: list[str] = []
+        collected = 0
+        for name in parts:
+            if name not in names:
+                continue
+            for line in _xml_paras(zf, name, *tags):
+                paras.append(line)
+                collected += len(line) + 1
+                if max_chars and collected >= max_chars:
+                    meta["X-Text-Truncated"] = "true"
+                    break
+            else:
+                paras.append("")  # blank line between parts
+                continue
+            break
+        if "docProps/core.xml" in names:
+            el = ET.fromstring(zf.read("docProps/core.xml")).find(_DC_TITLE)
+            if el is not None and (el.text or "").strip():
+                meta["title"] = el.text.strip()
+    return {"content": "\n".join(paras).strip(), "metadata": meta}
+
+# --- Tika -------------------------------------------------------------------
+
+class TikaPool:
+    """Keep-alive client for one or more Tika servers.
+
+    Calls rotate round-robin across servers. A server that refuses a
+    connection is skipped for `cooldown_s` and the file goes to the next
+    one. A read timeout is not retried elsewhere, because the file itself
+    is usually the problem. Each thread gets its own requests.Session, so
+    connections are reused without sharing a session between threads.
+    """
+
+    def __init__(self, servers: list[str], timeout_s: float = 120.0, connect_timeout_s: float = 5.0,
+                 cooldown_s: float = 30.0):
+        if not servers:
+            raise ValueError("TikaPool needs at least one server URL")
+        self.servers = [s.rstrip("/") for s in servers]
+        self.timeout = (connect_timeout_s, timeout_s)
+        self.cooldown_s = cooldown_s
+        self._rr = itertools.count()
+        self._down: dict[str, float] = {}
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(self.servers), pool_maxsize=4)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            self._local.session = s
+        return s
+
+    def _order(self) -> list[str]:
+        start = next(self._rr) % len(self.servers)
+        ring = self.servers[start:] + self.servers[:start]
+        now = time.monotonic()
+        up = [s for s in ring if self._down.get(s, 0.0) <= now]
+        return up or ring  # all cooling down: try them anyway
+
+    def parse(self, src: BinaryIO, max_chars: int = 0) -> dict:
+        """Stream the file to a server; max_chars becomes Tika's writeLimit."""
+        headers = {"Accept": "application/json"}
+        if max_chars:
+            headers["writeLimit"] = str(max_chars)
+        last = None
+        for server in self._order():
+            src.seek(0)
+            try:
+                r = self._session().put(f"{server}/rmeta/text", data=src, timeout=self.timeout,
+                                        headers=headers)
+            except requests.ConnectionError as e:
+                self._down[server] = time.monotonic() + self.cooldown_s
+                last = e
+                continue
+            except requests.Timeout as e:
+                raise ExtractError(f"Tika timed out after {self.timeout[1]}s ({server})") from e
+            if r.status_code != 200:
+                # 422 = Tika could not parse this file; no point retrying it elsewhere
+                raise ExtractError(f"Tika returned HTTP {r.status_code} ({server})")
+            docs = r.json() or [{}]
+            # container first, then embedded documents (attachments, OLE objects)
+            content = "\n".join((d.get("X-TIKA:content") or "").strip() for d in docs).strip()
+            meta = {k: v for k, v in docs[0].items() if k != "X-TIKA:content"}
+            return {"content": content, "metadata": meta}
+        raise ExtractError(f"No Tika server reachable: {last}")
+
+def _tika_python(src: BinaryIO, timeout_s: float, max_chars: int = 0) -> dict:
+    from tika import parser as tika_parser  # downloads/starts Tika server on first use
+    # from_buffer avoids path/URI issues on Windows; requests streams the file object
+    headers = {"writeLimit": str(max_chars)} if max_chars else None
+    out = tika_parser.from_buffer(src, headers=headers, requestOptions={"timeout": timeout_s})
+    if out.get("status") not in (None, 200):
+        raise ExtractError(f"Tika returned HTTP {out.get('status')}")
+    return {"content": (out.get("content") or "").strip(), "metadata": out.get("metadata") or {}}
+
+# --- dispatch ---------------------------------------------------------------
+
+class Extractor:
+    """Pick a backend per file. `native` lists which native paths are enabled
+    ("html", "ooxml"); a failing native parse falls back to Tika. Extracted
+    text is capped at max_chars (0 = no cap)."""
+
+    def __init__(self, tika_servers: Optional[list[str]] = None, timeout_s: float = 120.0,
+                 native: Optional[set[str]] = None, max_chars: int = 0):
+        self.timeout_s = timeout_s
+        self.max_chars = max_chars
+        self.native = NATIVE_KINDS if native is None else set(native)
+        self.pool = TikaPool(tika_servers, timeout_s) if tika_servers else None
+
+    @property
+    def fingerprint(self) -> str:
+        """The settings that change extracted text; the extraction cache only
+        serves entries made under the same fingerprint."""
+        return f"native={','.join(sorted(self.native))};max_chars={self.max_chars}"
+
+    def tika(self, src: BinaryIO) -> dict:
+        with TIKA_SECONDS.time():
+            if self.pool is not None:
+                return self.pool.parse(src, self.max_chars)
+            return _tika_python(src, self.timeout_s, self.max_chars)
+
+    def _extract(self, src: BinaryIO, suffix: str) -> dict:
+        try:
+            if suffix in HTML_SUFFIXES and "html" in self.native:
+                with NATIVE_SECONDS.time():
+                    return extract_html(src, self.max_chars)
+            if suffix in OOXML_SUFFIXES and "ooxml" in self.native:
+                with NATIVE_SECONDS.time():
+                    return extract_ooxml(src, suffix, self.max_chars)
+        except (zipfile.BadZipFile, KeyError, ET.ParseError, ValueError):
+            pass  # encrypted, legacy-in-disguise or malformed: let Tika try
+        src.seek(0)
+        return self.tika(src)
+
+    def extract(self, src: BinaryIO | bytes, suffix: str) -> dict:
+        """src: a seekable binary file (read in chunks, never whole) or bytes."""
+        if isinstance(src, (bytes, bytearray)):
+            src = BytesIO(src)
+        out = self._extract(src, suffix.lower())
+        if self.max_chars and len(out["content"]) > self.max_chars:
+            out["content"] = out["content"][:self.max_chars]
+            out["metadata"]["X-Text-Truncated"] = "true"
+        return out
@@ -0,0 +1,143 @@
+"""Full-topic-set evaluation: chunked, parallel, resumable.
+
+Topics are sorted by qid and cut into fixed-size chunks. Each chunk is
+retrieved and scored on its own, and its run and per-query metrics are
+written to out_dir/chunks/. A chunk counts as done once its metrics file
+exists, and that file is written last and atomically, so a restarted run
+with the same out_dir skips finished chunks.
+"""
+import json
+import math
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import ir_measures
+import pandas as pd
+
+from src.runs import add_ranks, write_run
+
+_retr = None  # per-process retriever, opened by _init_worker
+
+def _init_worker(index_path: str, k: int, threads: int, heap_mb: int,
+                 agg: str = "max", passage_depth: int = 3, pruning: str | None = None) -> None:
+    global _retr
+    import pyterrier as pt
+    from src.retrieval import IndexHandle
+
+    if not pt.java.started():
+        pt.java.set_memory_limit(heap_mb)
+        pt.java.init()
+    _retr = IndexHandle(index_path).retriever(wmodel="BM25", k=k, threads=threads,
+                                              agg=agg, passage_depth=passage_depth, pruning=pruning)
+
+def _chunk_paths(out_dir: Path, i: int, run_ext: str) -> tuple[Path, Path]:
+    base = out_dir / "chunks" / f"chunk-{i:05d}"
+    return base.with_suffix(run_ext), base.with_suffix(".metrics.csv")
+
+def _eval_chunk(i: int, topics: pd.DataFrame, qrels: pd.DataFrame, measures: list[str],
+                out_dir: str, tag: str, run_ext: str) -> tuple[int, int]:
+    run_path, metrics_path = _chunk_paths(Path(out_dir), i, run_ext)
+    run_df = add_ranks(_retr.transform(topics))
+    write_run(run_df, run_path, tag, "parquet" if run_ext == ".parquet" else "trec")
+
+    qrels_ir = qrels.rename(columns={"qid": "query_id", "docno": "doc_id", "label": "relevance"})
+    run_ir = run_df[["qid", "docno", "score"]].rename(columns={"qid": "query_id", "docno": "doc_id"})
+    parsed = [ir_measures.parse_measure(m) for m in measures]
+    rows = [(m.query_id, str(m.measure), m.value) for m in ir_measures.iter_calc(parsed, qrels_ir, run_ir)]
+    per_query = pd.DataFrame(rows, columns=["qid", "measure", "value"])
+
+    tmp = metrics_path.with_suffix(".tmp")
+    per_query.to_csv(tmp, index=False)
+    os.replace(tmp, metrics_path)
+    return i, len(topics)
+
+def summarize(per_query: pd.DataFrame, z: float = 1.96) -> pd.DataFrame:
+    """Mean per measure with a normal-approximation confidence interval."""
+    g = per_query.groupby("measure")["value"]
+    out = pd.DataFrame({"n": g.count(), "mean": g.mean(), "std": g.std(ddof=1)})
+    half = z * out["std"] / out["n"].map(math.sqrt)
+    out["ci_low"] = out["mean"] - half
+    out["ci_high"] = out["mean"] + half
+    return out.reset_index()
+
+def run_full(topics: pd.DataFrame, qrels: pd.DataFrame, index_path: Path, measures: list[str],
+             k: int, out_dir: Path, tag: str, chunk_size: int = 1000, workers: int = 1,
+             threads: int = 1, heap_mb: int = 2048, agg: str = "max", passage_depth: int = 3,
+             pruning: str | None = None, run_ext: str = ".trec",
+             out_run: Path | None = None) -> pd.DataFrame:
+    """Evaluate every topic; returns the per-query metrics of all chunks and,
+    if out_run is given, concatenates the chunk runs into it."""
+    topics = topics.sort_values("qid").reset_index(drop=True)
+    chunks = [topics.iloc[s:s + chunk_size] for s in range(0, len(topics), chunk_size)]
+    (out_dir / "chunks").mkdir(parents=True, exist_ok=True)
+
+    from src.npindex import export_stamp
+    from src.retrieval import index_stamp
+
+    # a resumed run must cut the topics the same way and retrieve from the same
+    # index (and export, when pruning reads it) with the same settings
+    plan = {"n_topics": len(topics), "chunk_size": chunk_size, "k": k, "passage_agg": agg,
+            "passage_depth": passage_depth, "pruning": pruning, "run_ext": run_ext,
+            "index": list(index_stamp(index_path)),
+            "export": list(export_stamp(index_path)) if pruning else None,
+            "measures": measures, "first_qid": topics["qid"].iloc[0], "last_qid": topics["qid"].iloc[-1]}
+    plan_path = out_dir / "plan.json"
+    if plan_path.exists():
+        old = json.loads(plan_path.read_text(encoding="utf-8"))
+        if old != plan:
+            raise SystemExit(f"{out_dir} holds a different run plan ({old}); use a fresh --out_dir")
+    else:
+        plan_path.write_text(json.dumps(plan), encoding="utf-8")
+
+    todo = [i for i in range(len(chunks)) if not _chunk_paths(out_dir, i, run_ext)[1].exists()]
+    print(f"Full evaluation: {len(topics)} topics in {len(chunks)} chunks "
+          f"({len(chunks) - len(todo)} already done)", flush=True)
+
+    def _qrels_for(chunk):
+        return qrels[qrels["qid"].isin(chunk["qid"])]
+
+    done = len(chunks) - len(todo)
+    init_args = (str(index_path), k, threads, heap_mb, agg, passage_depth, pruning)
+    if not todo:
+        pass
+    elif workers <= 1:
+        _init_worker(*init_args)
+        for i in todo:
+            _eval_chunk(i, chunks[i], _qrels_for(chunks[i]), measures, str(out_dir), tag, run_ext)
+            done += 1
+            print(f"  chunk {i} done ({done}/{len(chunks)})", flush=True)
+    else:
+        # spawn: each worker starts its own JVM
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=init_args) as pool:
+            futs = [pool.submit(_eval_chunk, i, chunks[i], _qrels_for(chunks[i]), measures,
+                                str(out_dir), tag, run_ext) for i in todo]
+            for fut in as_completed(futs):
+                i, _ = fut.result()
+                done += 1
+                print(f"  chunk {i} done ({done}/{len(chunks)})", flush=True)
+
+    if out_run is not None:
+        merge_runs(out_dir, len(chunks), out_run, run_ext)
+    parts = [pd.read_csv(_chunk_paths(out_dir, i, run_ext)[1], dtype={"qid": str})
+             for i in range(len(chunks))]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["qid", "measure", "value"])
+
+def merge_runs(out_dir: Path, n_chunks: int, out_run: Path, run_ext: str) -> None:
+    """Concatenate chunk runs into one run file."""
+    out_run.parent.mkdir(parents=True, exist_ok=True)
+    paths = [_chunk_paths(out_dir, i, run_ext)[0] for i in range(n_chunks)]
+    if run_ext == ".parquet":
+        pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True).to_parquet(out_run, index=False)
+        return
+    with open(out_run, "wb") as out:
+        for p in paths:
+            with open(p, "rb") as f:
+                while True:
+                    buf = f.read(1 << 20)
+                    if not buf:
+                        break
+                    out.write(buf)
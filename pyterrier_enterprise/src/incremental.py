@@ -0,0 +1,138 @@
+"""Manifest and delta indexes for incremental builds.
+
+Layout under INDEX_DIR:
+    data.*            base Terrier index (written by a full build or compaction)
+    manifest.json     file path -> {size, mtime_ns, index[, parts]} plus the dead list
+    shards/shard-NN   shard indexes, when built with --shards (instead of data.*)
+    segments/segment-G-NNNN
+                      checkpointed full-build segments (see checkpoint.py), G = build generation
+    deltas/delta-NNNN small Terrier indexes holding new/changed documents
+
+A document lives in exactly one component ("base", a shard or a delta). When it
+changes or disappears, its old (component, docno) is recorded as dead so the
+retriever can drop those hits until the next compaction rebuilds the base.
+A file split into passages (see passages.py) has `parts` set and all of its
+passage docnos go dead together. Files that crashed the indexer are listed
+under "failed" (path -> {size, mtime_ns}) and skipped until they change.
+Empty and duplicate files left out by dedup.py are listed under "skipped",
+with the same keys plus why, and are likewise left alone until they change.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, Dict
+
+from src.corpus import stat_many
+from src.passages import docnos_of
+
+MANIFEST_NAME = "manifest.json"
+DELTA_DIR = "deltas"
+DELTA_PREFIX = "delta-"
+SHARD_DIR = "shards"
+SHARD_PREFIX = "shard-"
+SEGMENT_DIR = "segments"
+SEGMENT_PREFIX = "segment-"
+BASE = "base"
+
+def empty_manifest() -> dict:
+    return {"version": 0, "components": [BASE], "docs": {}, "dead": {}}
+
+def load_json(p: Path) -> dict | None:
+    if not p.exists():
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_manifest(index_dir: Path) -> dict | None:
+    return load_json(Path(index_dir) / MANIFEST_NAME)
+
+def save_json(p: Path, obj: dict) -> None:
+    """Write via a temp file + rename, so readers never see a partial file."""
+    tmp = p.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, p)
+
+def save_manifest(index_dir: Path, manifest: dict) -> None:
+    save_json(Path(index_dir) / MANIFEST_NAME, manifest)
+
+def component_path(index_dir: Path, name: str) -> Path:
+    if name == BASE:
+        return Path(index_dir)
+    if name.startswith(SHARD_PREFIX):
+        return Path(index_dir) / SHARD_DIR / name
+    if name.startswith(SEGMENT_PREFIX):
+        return Path(index_dir) / SEGMENT_DIR / name
+    return Path(index_dir) / DELTA_DIR / name
+
+def track(docs: Iterable[Dict], manifest: dict, component: str) -> Iterator[Dict]:
+    """Pass docs through to the indexer, recording each file in the manifest.
+    Passages of a split file arrive back to back and are counted in `parts`."""
+    entries = manifest["docs"]
+    current = None
+    for doc in docs:
+        path = doc["path"]
+        if path == current:
+            entries[path]["parts"] += 1
+            yield doc
+            continue
+        if "mtime_ns" in doc:
+            size, mtime_ns = doc["size"], doc["mtime_ns"]  # stat'ed when the file was read
+        else:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        old = entries.get(path)
+        if old is not None and old["index"] != component:
+            manifest["dead"].setdefault(old["index"], []).extend(docnos_of(path, old))
+        manifest.get("failed", {}).pop(path, None)
+        manifest.get("skipped", {}).pop(path, None)
+        entry = {"size": size, "mtime_ns": mtime_ns, "index": component}
+        if doc["docno"] != path:
+            entry["parts"] = 1
+        entries[path] = entry
+        current = path
+        yield doc
+
+def scan_changes(files: Iterable[Path], manifest: dict, workers: int = 1) -> tuple[list[Path], list[str]]:
+    """Compare the corpus against the manifest; return (new/changed files, deleted paths).
+    workers > 1 stats files concurrently, in batches."""
+    entries = manifest["docs"]
+    failed = manifest.get("failed", {})
+    skipped = manifest.get("skipped", {})
+    seen = set()
+    changed = []
+    for fp, st in stat_many(files, workers):
+        docno = str(fp)
+        seen.add(docno)
+        if st is None:
+            continue
+        old = entries.get(docno) or failed.get(docno) or skipped.get(docno)
+        if old is None or old["size"] != st.st_size or old["mtime_ns"] != st.st_mtime_ns:
+            changed.append(fp)
+    deleted = [d for d in entries if d not in seen] + [d for d in skipped if d not in seen]
+    return changed, deleted
+
+def mark_deleted(manifest: dict, paths: Iterable[str]) -> None:
+    for path in paths:
+        manifest.get("skipped", {}).pop(path, None)
+        old = manifest["docs"].pop(path, None)
+        if old is not None:
+            manifest["dead"].setdefault(old["index"], []).extend(docnos_of(path, old))
+
+def next_delta_name(manifest: dict) -> str:
+    n = sum(1 for c in manifest["components"] if c.startswith(DELTA_PREFIX)) + 1
+    return f"{DELTA_PREFIX}{n:04d}"
+
+def swap_in(index_dir: Path, new_dir: Path) -> None:
+    """Replace index_dir (base + deltas) with a freshly built new_dir."""
+    index_dir = Path(index_dir)
+    old = index_dir.with_name(index_dir.name + ".old")
+    if old.exists():
+        shutil.rmtree(old)
+    os.replace(index_dir, old)
+    os.replace(new_dir, index_dir)
+    shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,101 @@
+"""Indexer settings shared by the full build, delta builds and compaction."""
+from pathlib import Path
+from typing import Iterable, Iterator, Dict, Optional
+
+import pyterrier as pt
+
+from src.config import settings
+from src.dedup import Deduper
+from src.docstore import DocStoreWriter
+from src.extract import load_docs
+from src.extract_cache import ExtractCache
+from src.extractors import Extractor
+from src.passages import split_docs
+from src.snippets import SnippetWriter
+from src.metrics import Progress
+
+INDEX_FIELDS = ["text", "title"]  # TEXT fields for BM25
+# Short fields only: path/title/content live in the docstore (src/docstore.py),
+# so they're neither padded to a fixed width nor truncated here.
+INDEX_META = {
+    "docno": 2048,
+    "content_type": 128,
+    "modified": 64,
+}
+
+def init_java() -> None:
+    # Heap tune; explicit init to avoid deprecation warning
+    if not pt.java.started():
+        pt.java.set_memory_limit(settings.index_heap_mb)
+        pt.java.init()
+
+def make_indexer(index_dir: Path) -> "pt.IterDictIndexer":
+    return pt.IterDictIndexer(
+        str(index_dir),
+        fields=INDEX_FIELDS,
+        meta=INDEX_META,
+        blocks=False
+    )
+
+def index_docs(index_dir: Path, docs: Iterable[Dict], label: str = "index", total: Optional[int] = None):
+    """Index docs into index_dir, writing the docstore (and snippet store)
+    alongside in docid order. Logs throughput every PROGRESS_INTERVAL_S;
+    total (if known) gives an ETA."""
+    store = DocStoreWriter(index_dir)
+    snippets = SnippetWriter(index_dir, settings.snippet_scan_chars) if settings.snippet_scan_chars > 0 else None
+    docs = store.wrap(docs)
+    if snippets is not None:
+        docs = snippets.wrap(docs)
+    progress = Progress(label, total, settings.progress_interval_s)
+    try:
+        return make_indexer(index_dir).index(progress.wrap(docs))
+    finally:
+        store.close()
+        if snippets is not None:
+            snippets.close()
+
+def open_cache() -> Optional[ExtractCache]:
+    if not settings.extract_cache:
+        return None
+    print(f"Extraction cache: {settings.extract_cache}")
+    return ExtractCache(settings.extract_cache)
+
+def close_cache(cache: Optional[ExtractCache]) -> None:
+    if cache is None:
+        return
+    cache.commit()
+    removed = cache.evict(settings.extract_cache_max_bytes, settings.extract_cache_max_age_days)
+    st = cache.stats()
+    print(f"Extraction cache: hits={st['hits']} hash_hits={st['hash_hits']} misses={st['misses']} "
+          f"evicted={removed} entries={st['entries']} bytes={st['bytes']}")
+    cache.close()
+
+def make_extractor() -> Extractor:
+    servers = [s.strip() for s in settings.tika_servers.split(",") if s.strip()]
+    native = {k.strip() for k in settings.extract_native.split(",") if k.strip()}
+    if servers:
+        print(f"Tika servers: {', '.join(servers)}")
+    return Extractor(servers, settings.extract_timeout_s, native, settings.max_text_chars)
+
+def make_deduper() -> Optional[Deduper]:
+    if not settings.dedup:
+        return None
+    return Deduper(settings.dedup_threshold, settings.dedup_skip_empty)
+
+def docs_for(files: Iterable[Path], cache: Optional[ExtractCache] = None,
+             dedup: Optional[Deduper] = None) -> Iterator[Dict]:
+    """Parse files with the extraction settings from config, leaving out
+    what dedup skips (whole documents, before passage splitting)."""
+    docs = load_docs(files, settings.max_bytes_per_file, cache,
+                     workers=settings.extract_workers,
+                     queue_depth=settings.extract_queue_depth,
+                     ordered=settings.extract_ordered,
+                     extractor=make_extractor(),
+                     prefetch=settings.prefetch_files,
+                     prefetch_bytes=settings.prefetch_mb << 20,
+                     prefetch_file_bytes=settings.prefetch_file_mb << 20)
+    if dedup is not None:
+        docs = dedup.filter(docs)
+    stride = settings.passage_stride_words or settings.passage_words // 2
+    return split_docs(docs, settings.split_chars, settings.split_overlap_chars,
+                      settings.passage_words, stride)
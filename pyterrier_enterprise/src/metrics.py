@@ -0,0 +1,74 @@
+"""Prometheus metrics for indexing and serving, plus build progress logging.
+
+Histograms are process-local: the server exposes its own on /metrics, and
+1_build_index reads the extraction ones back for its progress lines.
+"""
+import time
+from typing import Iterable, Iterator, Dict, Optional
+
+from prometheus_client import Counter, Histogram, REGISTRY
+
+_FAST = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_SLOW = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# extraction / indexing
+READ_SECONDS = Histogram("extract_read_seconds", "Time in read() while streaming a corpus file", buckets=_SLOW)
+READ_BYTES = Counter("extract_read_bytes", "Bytes read from the corpus")
+TIKA_SECONDS = Histogram("extract_tika_seconds", "Tika round-trip per file", buckets=_SLOW)
+NATIVE_SECONDS = Histogram("extract_native_seconds", "Native HTML/OOXML extraction per file", buckets=_FAST)
+INDEX_DOCS = Counter("index_docs", "Documents handed to the Terrier indexer")
+INDEX_CONSUME_SECONDS = Counter("index_consume_seconds", "Time the indexer spent between pulling documents")
+
+# serving
+SEARCH_SECONDS = Histogram("search_request_seconds", "End-to-end request time", ["endpoint"], buckets=_FAST)
+RETRIEVE_SECONDS = Histogram("search_retrieve_seconds", "_br.transform per batch", buckets=_FAST)
+RETRIEVE_BATCH = Histogram("search_retrieve_batch_size", "Queries per transform call",
+                           buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+META_SECONDS = Histogram("search_meta_seconds", "Docstore/meta field fetch per request", buckets=_FAST)
+ENCODE_SECONDS = Histogram("search_encode_seconds", "Response JSON encoding", buckets=_FAST)
+SNIPPET_SECONDS = Histogram("search_snippet_seconds", "Snippet generation per request", buckets=_FAST)
+
+def _value(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0.0
+
+class Progress:
+    """Wrap the doc stream fed to the indexer and log docs/s, MB/s and an ETA
+    every `interval_s`. Time spent inside the indexer (between our yields) is
+    split from time spent producing docs, along with the read/Tika totals."""
+
+    def __init__(self, label: str, total: Optional[int] = None, interval_s: float = 60.0):
+        self.label = label
+        self.total = total
+        self.interval_s = interval_s
+        self.count = 0
+        self.start = time.perf_counter()
+        self.consume_s = 0.0
+
+    def wrap(self, docs: Iterable[Dict]) -> Iterator[Dict]:
+        last = self.start
+        for doc in docs:
+            self.count += 1
+            t0 = time.perf_counter()
+            yield doc
+            t1 = time.perf_counter()
+            self.consume_s += t1 - t0
+            INDEX_DOCS.inc()
+            INDEX_CONSUME_SECONDS.inc(t1 - t0)
+            if t1 - last >= self.interval_s:
+                self.log()
+                last = t1
+        self.log(final=True)
+
+    def log(self, final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        rate = self.count / elapsed
+        mb_s = _value("extract_read_bytes_total") / elapsed / 1e6
+        eta = ""
+        if self.total and rate > 0 and not final:
+            remaining = max(self.total - self.count, 0) / rate
+            eta = f" eta={remaining / 3600:.1f}h ({self.count}/{self.total})"
+        print(f"[{self.label}] {'done' if final else 'progress'}: docs={self.count} "
+              f"{rate:.1f} docs/s {mb_s:.2f} MB/s{eta} | read={_value('extract_read_seconds_sum'):.0f}s "
+              f"tika={_value('extract_tika_seconds_sum'):.0f}s "
+              f"native={_value('extract_native_seconds_sum'):.0f}s indexer={self.consume_s:.0f}s "
+              f"wall={elapsed:.0f}s", flush=True)
@@ -0,0 +1,395 @@
+"""NumPy export of the inverted index: pruning metadata plus a JVM-free serving copy.
+
+Written by `1_build_index --pruning_meta` (or `python -m src.5_export_index`)
+after a build. It covers every component the IndexHandle serves (base or
+shards, plus deltas), with component docids offset exactly as in the
+MultiIndex. Layout under INDEX_DIR/npindex:
+
+    meta.json        collection stats, BM25 k1/b, block size, term pipeline,
+                     components + docid offsets, index stamp
+    terms.npy        sorted lexicon (fixed-width unicode)
+    df.npy           document frequency per term
+    gaps{1,2,4}.npy  docid gaps (first entry: the docid itself) for terms whose
+                     largest gap fits in 1, 2 or 4 bytes
+    gap_width.npy    uint8 width class of each term's gaps
+    gap_off.npy      int64 offset of each term's gaps within its width class
+    tfs{1,2,4}.npy, tf_width.npy, tf_off.npy
+                     term frequencies, packed the same way
+    ftf<j>s{1,2,4}.npy, ftf<j>_width.npy, ftf<j>_off.npy
+                     per-field term frequencies of field j (meta "fields"),
+                     packed the same way; only for indexes built with fields
+    doclen.npy       int32 document lengths
+    flen.npy         int32 field lengths, n_docs x n_fields
+    live.npy         bool, False for superseded/deleted documents
+    ub.npy           per-term max BM25 contribution (query tf 1)
+    blk_ptr.npy      int64 block offsets per term, n_terms + 1 entries
+    blk_max.npy      per-block max BM25 contribution
+    blk_last.npy     int32 last docid of each block
+    <field>.npy, <field>_off.npy
+                     meta index fields (docno, content_type, modified) as
+                     UTF-8 bytes plus int64 offsets, n_docs + 1 entries
+    stopwords.txt    Terrier's stopword list, for query processing without Java
+
+Every file is memory-mapped on load, so worker processes share the pages
+through the OS page cache. The export is tied to the index stamp and must be
+redone after a delta build or compaction.
+"""
+import json
+import os
+import shutil
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+
+from src import incremental as inc
+from src.indexing import INDEX_META
+from src.retrieval import IndexHandle, index_stamp
+
+NPINDEX_DIR = "npindex"
+BLOCK_POSTINGS = 128
+WIDTHS = {1: np.uint8, 2: np.uint16, 4: np.uint32}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def bm25_idf(n_docs: int, df: np.ndarray) -> np.ndarray:
+    # Terrier's BM25: log2((N - df + 0.5) / (df + 0.5)); negative for very common terms
+    df = np.asarray(df, dtype=np.float64)
+    return np.log2((n_docs - df + 0.5) / (df + 0.5))
+
+def bm25_tf(tf: np.ndarray, dl: np.ndarray, avgdl: float, k1: float = BM25_K1, b: float = BM25_B) -> np.ndarray:
+    tf = np.asarray(tf, dtype=np.float64)
+    return (k1 + 1.0) * tf / (k1 * ((1.0 - b) + b * np.asarray(dl, dtype=np.float64) / avgdl) + tf)
+
+def bm25_qtf(qtf: np.ndarray, k3: float = 8.0) -> np.ndarray:
+    qtf = np.asarray(qtf, dtype=np.float64)
+    return (k3 + 1.0) * qtf / (k3 + qtf)
+
+def field_names(index) -> list[str]:
+    """Names of the index's fields, in Terrier's field order (lower-case)."""
+    n = int(index.getCollectionStatistics().getNumberOfFields())
+    names = [f.strip().lower() for f in str(index.getIndexProperty("index.inverted.fields.names", "")).split(",")
+             if f.strip()]
+    return names if len(names) == n else [f"field{j}" for j in range(n)]
+
+def _component_postings(index, offset: int):
+    """Stream one Terrier index's postings into flat arrays (lexicon order),
+    with per-field frequencies and lengths if the index has fields."""
+    EOL = pt.java.autoclass("org.terrier.structures.postings.IterablePosting").EOL
+    lex, inv = index.getLexicon(), index.getInvertedIndex()
+    nf = int(index.getCollectionStatistics().getNumberOfFields())
+    terms: list[str] = []
+    ptr = array("q", [0])
+    docids, tfs = array("i"), array("i")
+    ftfs = [array("i") for _ in range(nf)]
+    it = lex.iterator()
+    while it.hasNext():
+        entry = it.next()
+        terms.append(entry.getKey())
+        ip = inv.getPostings(entry.getValue())
+        fp = pt.java.cast("org.terrier.structures.postings.FieldPosting", ip) if nf else None
+        while ip.next() != EOL:
+            docids.append(ip.getId() + offset)
+            tfs.append(ip.getFrequency())
+            if nf:
+                for j, f in enumerate(fp.getFieldFrequencies()):
+                    ftfs[j].append(f)
+        ip.close()
+        ptr.append(len(docids))
+    doi = index.getDocumentIndex()
+    n = index.getCollectionStatistics().getNumberOfDocuments()
+    doclen = np.fromiter((doi.getDocumentLength(i) for i in range(n)), dtype=np.int32, count=n)
+    flen = np.zeros((n, nf), dtype=np.int32)
+    if nf:
+        fdoi = pt.java.cast("org.terrier.structures.FieldDocumentIndex", doi)
+        for i in range(n):
+            flen[i] = fdoi.getFieldLengths(i)
+    ftf = np.array([np.frombuffer(a, dtype=np.int32) for a in ftfs], dtype=np.int32).reshape(nf, len(docids))
+    return (np.asarray(terms, dtype=str), np.frombuffer(ptr, dtype=np.int64),
+            np.frombuffer(docids, dtype=np.int32), np.frombuffer(tfs, dtype=np.int32), doclen, ftf, flen)
+
+def _merge(parts):
+    """Merge per-component postings into one term-sorted set. Components come
+    in docid order, so a stable sort on term id keeps docids ascending."""
+    # np.unique also puts the lexicon in NumPy's (code point) order for searchsorted
+    terms, inverse = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+    starts = np.cumsum([0] + [len(p[0]) for p in parts])
+    term_of = np.concatenate([
+        np.repeat(inverse[starts[i]:starts[i + 1]], np.diff(p[1])) for i, p in enumerate(parts)])
+    order = np.argsort(term_of, kind="stable")
+    docids = np.concatenate([p[2] for p in parts])[order]
+    tfs = np.concatenate([p[3] for p in parts])[order]
+    ftfs = np.concatenate([p[5] for p in parts], axis=1)[:, order]
+    ptr = np.concatenate([[0], np.cumsum(np.bincount(term_of, minlength=len(terms)))]).astype(np.int64)
+    return terms, ptr, docids, tfs, ftfs
+
+def _meta_columns(handle: IndexHandle, n_docs: int, fields: list[str], chunk: int = 10000) -> dict[str, list]:
+    """Meta index fields for every docid, a chunk of docids per getItems call."""
+    out = {f: [] for f in fields}
+    for start in range(0, n_docs, chunk):
+        cols = handle.fetch_fields(np.arange(start, min(start + chunk, n_docs)), fields)
+        for f in fields:
+            out[f].extend(v or "" for v in cols[f])
+    return out
+
+def _live_mask(handle: IndexHandle, docnos: list[str]) -> np.ndarray:
+    if not handle.n_dead:
+        return np.ones(len(docnos), dtype=bool)
+    return handle.live_mask(pd.DataFrame({"docid": np.arange(len(docnos)), "docno": docnos}))
+
+def _terrier_stopwords() -> list[str]:
+    """The stopword list Terrier's Stopwords stage uses (a file, or a classpath resource)."""
+    name = str(pt.java.autoclass("org.terrier.utility.ApplicationSetup").getProperty(
+        "stopwords.filename", "stopword-list.txt"))
+    if Path(name).is_file():
+        text = Path(name).read_text(encoding="utf-8")
+    else:
+        loader = pt.java.autoclass("java.lang.Thread").currentThread().getContextClassLoader()
+        stream = loader.getResourceAsStream(name)
+        if stream is None:
+            print(f"Stopword list {name} not found; npindex/stopwords.txt left empty", flush=True)
+            return []
+        Scanner = pt.java.autoclass("java.util.Scanner")
+        scanner = Scanner(stream, "UTF-8").useDelimiter("\\A")
+        text = str(scanner.next()) if scanner.hasNext() else ""
+        scanner.close()
+    return sorted({w.strip().lower() for w in text.split() if w.strip()})
+
+def pack(ptr: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray, dict[int, np.ndarray]]:
+    """Per-term byte packing: each term's values are stored at the smallest
+    width (1, 2 or 4 bytes) that holds its largest value. Returns
+    (width per term, offset per term within its width class, {width: values})."""
+    df = np.diff(ptr)
+    has = df > 0
+    vmax = np.zeros(len(df), dtype=np.int64)
+    vmax[has] = np.maximum.reduceat(values, ptr[:-1][has])
+    width = np.where(vmax < 1 << 8, 1, np.where(vmax < 1 << 16, 2, 4)).astype(np.uint8)
+    off = np.zeros(len(df), dtype=np.int64)
+    term_width = np.repeat(width, df)
+    streams = {}
+    for w, dtype in WIDTHS.items():
+        sel = width == w
+        off[sel] = np.cumsum(df[sel]) - df[sel]
+        streams[w] = values[term_width == w].astype(dtype)
+    return width, off, streams
+
+def docid_gaps(ptr: np.ndarray, docids: np.ndarray) -> np.ndarray:
+    """d-gaps within each term's (ascending) postings; a term's first entry keeps its docid."""
+    gaps = np.empty(len(docids), dtype=np.int64)
+    gaps[0:1] = docids[0:1]
+    gaps[1:] = np.diff(docids.astype(np.int64))
+    firsts = ptr[:-1][np.diff(ptr) > 0]
+    gaps[firsts] = docids[firsts]
+    return gaps
+
+class StringTable:
+    """Variable-length strings by docid: UTF-8 bytes plus an offsets array, both memory-mapped."""
+
+    def __init__(self, root: Path, name: str):
+        self.data = np.load(Path(root) / f"{name}.npy", mmap_mode="r")
+        self.offsets = np.load(Path(root) / f"{name}_off.npy", mmap_mode="r")
+
+    @staticmethod
+    def write(root: Path, name: str, values: list[str]) -> None:
+        raw = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(raw) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in raw], out=offsets[1:])
+        np.save(Path(root) / f"{name}.npy", np.frombuffer(b"".join(raw), dtype=np.uint8))
+        np.save(Path(root) / f"{name}_off.npy", offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes().decode("utf-8")
+
+    def get_many(self, ids) -> list[str]:
+        return [self[i] for i in ids]
+
+def block_maxima(ptr: np.ndarray, docids: np.ndarray, scores: np.ndarray, block: int):
+    """Per-term blocks of `block` postings: (blk_ptr, blk_max, blk_last)."""
+    lens = np.diff(ptr)
+    nb = (lens + block - 1) // block
+    blk_ptr = np.concatenate([[0], np.cumsum(nb)]).astype(np.int64)
+    total = int(blk_ptr[-1])
+    if total == 0:
+        return blk_ptr, np.zeros(0), np.zeros(0, dtype=np.int32)
+    local = np.arange(total) - np.repeat(blk_ptr[:-1], nb)
+    starts = np.repeat(ptr[:-1], nb) + local * block
+    blk_max = np.maximum.reduceat(scores, starts)
+    ends = np.append(starts[1:], len(docids))
+    return blk_ptr, blk_max, docids[ends - 1].astype(np.int32)
+
+def export(index_dir: Path, block: int = BLOCK_POSTINGS, k1: float = BM25_K1, b: float = BM25_B) -> Path:
+    """Export the (multi-component) index under index_dir into index_dir/npindex."""
+    index_dir = Path(index_dir)
+    handle = IndexHandle(index_dir)
+    stats = handle.index.getCollectionStatistics()
+    n_docs, n_tokens = int(stats.getNumberOfDocuments()), int(stats.getNumberOfTokens())
+    avgdl = n_tokens / max(n_docs, 1)
+
+    parts, fields = [], []
+    for name, off in zip(handle.names, handle.offsets):
+        print(f"Exporting postings: {name}", flush=True)
+        component = pt.IndexFactory.of(str(inc.component_path(index_dir, name)))
+        fields = fields or field_names(component)
+        parts.append(_component_postings(component, int(off)))
+    doclen = np.concatenate([p[4] for p in parts])
+    flen = np.concatenate([p[6] for p in parts])
+    terms, ptr, docids, tfs, ftfs = _merge(parts)
+    df = np.diff(ptr).astype(np.int32)
+
+    # per-posting BM25 contribution, in slices to bound memory
+    idf = bm25_idf(n_docs, df)
+    scores = np.empty(len(docids), dtype=np.float64)
+    term_of = np.repeat(np.arange(len(terms)), df)
+    step = 1 << 24
+    for s in range(0, len(docids), step):
+        sl = slice(s, s + step)
+        scores[sl] = idf[term_of[sl]] * bm25_tf(tfs[sl], doclen[docids[sl]], avgdl, k1, b)
+    del term_of
+    blk_ptr, blk_max, blk_last = block_maxima(ptr, docids, scores, block)
+    del scores
+    ub = np.full(len(terms), -np.inf)
+    has = np.diff(blk_ptr) > 0
+    ub[has] = np.maximum.reduceat(blk_max, blk_ptr[:-1][has])
+
+    out = index_dir / NPINDEX_DIR
+    tmp = index_dir / (NPINDEX_DIR + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    meta_fields = list(INDEX_META)
+    columns = _meta_columns(handle, n_docs, meta_fields)
+    for f in meta_fields:
+        StringTable.write(tmp, f, columns[f])
+    arrays = {"terms": terms, "df": df, "doclen": doclen, "live": _live_mask(handle, columns["docno"]),
+              "ub": ub, "blk_ptr": blk_ptr, "blk_max": blk_max, "blk_last": blk_last, "flen": flen}
+    packed = [("gap", docid_gaps(ptr, docids)), ("tf", tfs)] + [(f"ftf{j}", f) for j, f in enumerate(ftfs)]
+    for prefix, values in packed:
+        width, off, streams = pack(ptr, values)
+        arrays[f"{prefix}_width"], arrays[f"{prefix}_off"] = width, off
+        for w, stream in streams.items():
+            arrays[f"{prefix}s{w}"] = stream
+    del columns, docids, tfs, ftfs, packed
+    for name, a in arrays.items():
+        np.save(tmp / f"{name}.npy", a)
+    (tmp / "stopwords.txt").write_text("\n".join(_terrier_stopwords()), encoding="utf-8")
+    meta = {"n_docs": n_docs, "n_tokens": n_tokens, "avgdl": avgdl, "k1": k1, "b": b,
+            "block": block, "n_terms": len(terms), "n_postings": int(ptr[-1]),
+            "components": list(handle.names), "offsets": [int(o) for o in handle.offsets],
+            "meta_fields": meta_fields, "passages": handle.passages,
+            "stamp": list(handle.stamp), "version": handle.version,
+            "fields": fields, "field_tokens": [int(t) for t in flen.sum(axis=0, dtype=np.int64)],
+            # query terms must go through the same stopword/stemmer pipeline as the index
+            "termpipelines": str(handle.index.getIndexProperty("termpipelines", "Stopwords,PorterStemmer"))}
+    (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    # two renames, so readers only ever see a complete export (or none, briefly)
+    old = index_dir / (NPINDEX_DIR + ".old")
+    if old.exists():
+        shutil.rmtree(old)
+    if out.exists():
+        os.replace(out, old)
+    os.replace(tmp, out)
+    shutil.rmtree(old, ignore_errors=True)
+    size = sum(f.stat().st_size for f in out.iterdir())
+    print(f"npindex: {len(terms)} terms, {int(ptr[-1])} postings, {len(blk_max)} blocks, "
+          f"{size / 1e6:.1f} MB -> {out}", flush=True)
+    return out
+
+def export_stamp(index_dir: Path) -> tuple:
+    """Changes whenever an export is (re)written; lets servers notice a new one."""
+    try:
+        return ((Path(index_dir) / NPINDEX_DIR / "meta.json").stat().st_mtime_ns,)
+    except OSError:
+        return (None,)
+
+class NpIndex:
+    """Read-only, memory-mapped view of an export.
+
+    postings(t) decodes a term's packed gaps with one cumsum. Decoded docid
+    arrays are kept in an LRU of cache_mb; term frequencies are used
+    straight from the mapped pages."""
+
+    def __init__(self, index_dir: Path, cache_mb: int = 64):
+        root = Path(index_dir) / NPINDEX_DIR
+        self.root = root
+        self.meta = json.loads((root / "meta.json").read_text(encoding="utf-8"))
+        for name in ("terms", "df", "doclen", "live", "ub", "blk_ptr", "blk_max", "blk_last",
+                     "gap_width", "gap_off", "tf_width", "tf_off"):
+            setattr(self, name, np.load(root / f"{name}.npy", mmap_mode="r"))
+        self._gaps = {w: np.load(root / f"gaps{w}.npy", mmap_mode="r") for w in WIDTHS}
+        self._tfs = {w: np.load(root / f"tfs{w}.npy", mmap_mode="r") for w in WIDTHS}
+        self.n_docs = self.meta["n_docs"]
+        self.avgdl = self.meta["avgdl"]
+        self.k1, self.b = self.meta["k1"], self.meta["b"]
+        self.idf = bm25_idf(self.n_docs, self.df)
+        # per-field statistics (absent from exports of field-less indexes)
+        self.fields: list[str] = self.meta.get("fields", [])
+        self.flen = np.load(root / "flen.npy", mmap_mode="r") if self.fields else None
+        self._ftfs = [(np.load(root / f"ftf{j}_width.npy", mmap_mode="r"),
+                       np.load(root / f"ftf{j}_off.npy", mmap_mode="r"),
+                       {w: np.load(root / f"ftf{j}s{w}.npy", mmap_mode="r") for w in WIDTHS})
+                      for j in range(len(self.fields))]
+        self._cache: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_max = cache_mb << 20
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def open(index_dir: Path, stamp: tuple | None = None) -> "NpIndex | None":
+        """The export, or None if missing or older than the index (stamp)."""
+        root = Path(index_dir) / NPINDEX_DIR
+        if not (root / "meta.json").exists():
+            return None
+        np_index = NpIndex(index_dir)
+        if tuple(np_index.meta["stamp"]) != tuple(stamp or index_stamp(index_dir)):
+            return None
+        return np_index
+
+    def stopwords(self) -> set[str]:
+        path = self.root / "stopwords.txt"
+        return set(path.read_text(encoding="utf-8").split()) if path.exists() else set()
+
+    def term_ids(self, terms: list[str]) -> np.ndarray:
+        """Lexicon ids of terms (-1 if absent)."""
+        if not terms or not len(self.terms):
+            return np.full(len(terms), -1, dtype=np.int64)
+        q = np.asarray(terms, dtype=self.terms.dtype)
+        pos = np.searchsorted(self.terms, q)
+        pos = np.minimum(pos, len(self.terms) - 1)
+        return np.where(self.terms[pos] == q, pos, -1)
+
+    def _docids(self, t: int) -> np.ndarray:
+        with self._lock:
+            d = self._cache.get(t)
+            if d is not None:
+                self._cache.move_to_end(t)
+                return d
+        o, n = int(self.gap_off[t]), int(self.df[t])
+        d = np.cumsum(self._gaps[int(self.gap_width[t])][o:o + n], dtype=np.int32)
+        with self._lock:
+            if t not in self._cache and d.nbytes <= self._cache_max:
+                self._cache[t] = d
+                self._cache_bytes += d.nbytes
+                while self._cache_bytes > self._cache_max:
+                    self._cache_bytes -= self._cache.popitem(last=False)[1].nbytes
+        return d
+
+    def postings(self, t: int) -> tuple[np.ndarray, np.ndarray]:
+        """(docids ascending, term frequencies) of term id t."""
+        o, n = int(self.tf_off[t]), int(self.df[t])
+        return self._docids(t), self._tfs[int(self.tf_width[t])][o:o + n]
+
+    def field_tfs(self, t: int) -> np.ndarray:
+        """Per-field term frequencies of term id t, n_fields x df, aligned with postings(t)."""
+        n = int(self.df[t])
+        out = np.zeros((len(self._ftfs), n), dtype=np.int32)
+        for j, (width, off, streams) in enumerate(self._ftfs):
+            o = int(off[t])
+            out[j] = streams[int(width[t])][o:o + n]
+        return out
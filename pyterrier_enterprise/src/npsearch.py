@@ -0,0 +1,193 @@
+"""Serving BM25 from the NumPy export (src/npindex.py), with or without a JVM.
+
+NpHandle stands in for IndexHandle when SEARCH_ENGINE=numpy. It opens only
+memory-mapped arrays and the docstores, so a server worker needs no Java
+heap, and every worker shares the index pages through the page cache.
+Query terms have to match the index's term pipeline:
+
+  - TerrierTermPipeline runs Terrier's own stages (exact, needs the JVM).
+  - PythonTermPipeline uses the stopword list exported with the index and
+    NLTK's Porter stemmer (nltk, in requirements.txt).
+"""
+import re
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+
+from src import incremental as inc
+from src.dedup import cluster_table
+from src.docstore import DocStore
+from src.npindex import NpIndex, StringTable, export_stamp
+from src.passages import aggregate
+from src.pruning import PRUNING_MODES, ExhaustiveScorer, PrunedScorer
+from src.retrieval import docstore_columns
+from src.snippets import open_stores, snippet_column
+
+SCORERS = ("exhaustive",) + PRUNING_MODES
+_TOKEN = re.compile(r"[A-Za-z0-9]+")  # EnglishTokeniser: ASCII letters and digits
+MAX_TERM_LENGTH = 20
+
+def _keep_token(tok: str) -> bool:
+    # Terrier's EnglishTokeniser drops long tokens, >4 digits, and runs of >4 equal chars
+    if len(tok) > MAX_TERM_LENGTH:
+        return False
+    run, digits, prev = 0, 0, ""
+    for ch in tok:
+        digits += ch.isdigit()
+        run = run + 1 if ch == prev else 0
+        prev = ch
+        if run > 3 or digits > 4:
+            return False
+    return True
+
+def tokenise(query: str) -> list[str]:
+    return [t.lower() for t in _TOKEN.findall(query) if _keep_token(t)]
+
+class TerrierTermPipeline:
+    """Stopwords + stemmer through Terrier's own term pipeline (needs the JVM)."""
+
+    def __init__(self, pipeline: str = "Stopwords,PorterStemmer"):
+        Accessor = pt.java.autoclass("org.terrier.terms.BaseTermPipelineAccessor")
+        self._tp = Accessor(*[p.strip() for p in pipeline.split(",") if p.strip()])
+
+    def __call__(self, tokens: list[str]) -> list[str]:
+        out = []
+        for tok in tokens:
+            term = self._tp.pipelineTerm(tok)
+            if term:
+                out.append(term)
+        return out
+
+class PythonTermPipeline:
+    """The same stages without Java: Stopwords (the exported list) and
+    PorterStemmer (NLTK, in the mode that follows Porter's reference
+    implementation, which Terrier's stemmer is a port of)."""
+
+    def __init__(self, pipeline: str, stopwords: set[str]):
+        self._stages: list[Callable[[str], str]] = []
+        for stage in (p.strip() for p in pipeline.split(",")):
+            if not stage:
+                continue
+            if stage == "Stopwords":
+                self._stages.append(lambda t: "" if t in stopwords else t)
+            elif stage == "PorterStemmer":
+                try:
+                    from nltk.stem.porter import PorterStemmer
+                except ImportError:
+                    raise RuntimeError("SEARCH_ENGINE=numpy needs NLTK for Porter stemming: pip install nltk")
+                stem = PorterStemmer(mode=PorterStemmer.MARTIN_EXTENSIONS).stem
+                self._stages.append(lambda t: stem(t, to_lowercase=False))
+            else:
+                raise ValueError(f"Term pipeline stage {stage} has no Python equivalent")
+
+    def __call__(self, tokens: list[str]) -> list[str]:
+        out = []
+        for tok in tokens:
+            for stage in self._stages:
+                tok = stage(tok)
+                if not tok:
+                    break
+            if tok:
+                out.append(tok)
+        return out
+
+class NpRetriever(pt.Transformer):
+    """Drop-in for pt.terrier.Retriever(wmodel="BM25") over an NpIndex.
+    mode is "exhaustive", "maxscore" or "blockmax"; all three return the same
+    top k. Returns qid, query, docid, docno, score, rank; dead documents never
+    appear."""
+
+    def __init__(self, npx: NpIndex, num_results: int, mode: str = "exhaustive",
+                 docnos: Optional[Callable[[np.ndarray], list]] = None,
+                 term_pipeline: Optional[Callable[[list[str]], list[str]]] = None):
+        if mode not in SCORERS:
+            raise ValueError(f"Unknown scorer: {mode} (use one of {SCORERS})")
+        self.scorer = ExhaustiveScorer(npx) if mode == "exhaustive" else PrunedScorer(npx, mode)
+        self.num_results = num_results
+        self.docnos = docnos
+        self.term_pipeline = term_pipeline or TerrierTermPipeline(npx.meta.get("termpipelines", "Stopwords,PorterStemmer"))
+
+    def transform(self, topics: pd.DataFrame) -> pd.DataFrame:
+        frames = []
+        for qid, query in zip(topics["qid"], topics["query"]):
+            docids, scores = self.scorer.search(self.term_pipeline(tokenise(query)), self.num_results)
+            frames.append(pd.DataFrame({"qid": qid, "query": query, "docid": docids, "score": scores,
+                                        "rank": np.arange(len(docids))}))
+        res = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=["qid", "query", "docid", "score", "rank"])
+        res["docno"] = self.docnos(res["docid"].to_numpy()) if self.docnos is not None and len(res) else ""
+        return res[["qid", "query", "docid", "docno", "score", "rank"]]
+
+class NpHandle:
+    """Read-only index handle over the export, for serving without a JVM.
+
+    Mirrors what app/server.py uses from IndexHandle: retriever(),
+    fetch_fields(), snippets(), duplicates, stamp, version. Docstore fields come from each
+    component's docstore; meta fields from the exported string tables.
+    stamp follows the export (not the Terrier index), so a server reloads
+    once a fresh export lands.
+    """
+
+    def __init__(self, index_dir: str | Path, cache_mb: int = 64):
+        index_dir = Path(index_dir)
+        self.stamp = export_stamp(index_dir)
+        if self.stamp[0] is None:
+            raise FileNotFoundError(f"No npindex under {index_dir}; run `python -m src.5_export_index` first")
+        self.index_dir = index_dir
+        self.npx = NpIndex(index_dir, cache_mb)
+        self.index = self.npx
+        meta = self.npx.meta
+        self.version = meta["version"]
+        self.names = meta["components"]
+        self.offsets = np.asarray(meta["offsets"], dtype=np.int64)
+        self.passages = meta["passages"]
+        self.docstores = [DocStore.open(inc.component_path(index_dir, n)) for n in self.names]
+        self.snippet_stores = open_stores(inc.component_path(index_dir, n) for n in self.names)
+        self.tables = {f: StringTable(self.npx.root, f) for f in meta["meta_fields"]}
+        self.duplicates = cluster_table(inc.load_manifest(index_dir))
+        self._term_pipeline = None
+        self._stopwords = None
+
+    def term_pipeline(self) -> Callable[[list[str]], list[str]]:
+        if self._term_pipeline is None:
+            pipeline = self.npx.meta.get("termpipelines", "Stopwords,PorterStemmer")
+            self._term_pipeline = PythonTermPipeline(pipeline, self.npx.stopwords())
+        return self._term_pipeline
+
+    def fetch_fields(self, docids, fields: list[str]) -> dict[str, list]:
+        """Stored fields for many hits at once, as one column per field."""
+        docids = np.asarray(docids, dtype=np.int64)
+        out, need = docstore_columns(self.docstores, self.offsets, docids, fields)
+        for f in fields:
+            rows = np.flatnonzero(need[f])
+            table = self.tables.get(f)
+            if not len(rows) or table is None:
+                continue
+            col = out[f]
+            for r, v in zip(rows, table.get_many(docids[rows])):
+                col[r] = v
+        return out
+
+    def snippets(self, docids, query: str, chars: int) -> list[str]:
+        """Query-biased snippets (src/snippets.py); "" where none were stored."""
+        if self._stopwords is None:
+            self._stopwords = PythonTermPipeline("Stopwords", self.npx.stopwords())
+        terms = self._stopwords(tokenise(query))
+        return snippet_column(self.snippet_stores, self.offsets, docids, terms, chars)
+
+    def retriever(self, wmodel: str = "BM25", k: int = 1000, threads: int = 1,
+                  agg: str = "max", passage_depth: int = 3, pruning: str | None = None):
+        """Same contract as IndexHandle.retriever. pruning picks MaxScore or
+        block-max; without it every posting is scored. threads is unused."""
+        if wmodel != "BM25":
+            raise ValueError(f"The NumPy engine supports BM25 only, not {wmodel}")
+        depth = k * max(1, passage_depth) if self.passages else k
+        docno = self.tables["docno"]
+        pipe = NpRetriever(self.npx, depth, pruning or "exhaustive", docnos=docno.get_many,
+                           term_pipeline=self.term_pipeline())
+        if not self.passages:
+            return pipe
+        return (pipe >> pt.apply.generic(lambda res: aggregate(res, k, agg))) % k
@@ -0,0 +1,126 @@
+"""Splitting documents into passages, and folding passage hits back into documents.
+
+A split document is indexed as several Terrier documents with docnos
+`<path>%p<n>` (n from 0). Each one carries the original `path`, and the
+manifest still tracks the file as a whole. Documents that fit in one
+passage keep docno = path.
+
+Two ways to split:
+  - SPLIT_CHARS: only documents longer than this many characters are cut.
+  - PASSAGE_WORDS / PASSAGE_STRIDE_WORDS: every document becomes overlapping
+    word windows (passage mode), so long and short files compete on
+    passage-length scores.
+At query time, aggregate() turns passage hits into document hits (MaxP or FirstP).
+"""
+import re
+from typing import Iterable, Iterator, Dict
+
+import pandas as pd
+
+PASSAGE_SEP = "%p"
+_BREAK = re.compile(r"\n\s*\n|\n|(?<=[.!?])\s+")
+_WORD = re.compile(r"\S+")
+_PASSAGE_SUFFIX = re.compile(re.escape(PASSAGE_SEP) + r"\d+$")
+AGGREGATIONS = ("max", "first")
+
+def passage_docno(path: str, n: int) -> str:
+    return f"{path}{PASSAGE_SEP}{n}"
+
+def doc_of(docno: str) -> str:
+    """The document (file path) a docno belongs to."""
+    head, sep, tail = docno.rpartition(PASSAGE_SEP)
+    return head if sep and tail.isdigit() else docno
+
+def docnos_of(path: str, entry: dict) -> list[str]:
+    """All docnos a manifest entry was indexed under."""
+    parts = entry.get("parts", 0)
+    return [passage_docno(path, i) for i in range(parts)] if parts else [path]
+
+def split_text(text: str, max_chars: int, overlap: int = 0) -> list[str]:
+    """Cut text into pieces of at most max_chars, preferring paragraph, line
+    and sentence boundaries in the back half of each window. Consecutive
+    pieces share up to `overlap` characters."""
+    if len(text) <= max_chars:
+        return [text]
+    overlap = min(max(overlap, 0), max_chars // 2)
+    out = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            lo = start + max_chars // 2
+            cut = None
+            for m in _BREAK.finditer(text, lo, end):
+                cut = m.end()
+            if cut:
+                end = cut
+        out.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [p for p in out if p]
+
+def window_text(text: str, words: int, stride: int) -> list[str]:
+    """Windows of `words` words starting every `stride` words, cut from the
+    original text so spacing and line breaks survive. The last window is
+    always anchored at the end, so the tail is never dropped."""
+    spans = [m.span() for m in _WORD.finditer(text)]
+    if len(spans) <= words:
+        return [text.strip()] if spans else [text]
+    stride = max(1, min(stride or words, words))
+    starts = list(range(0, len(spans) - words + 1, stride))
+    if starts[-1] + words < len(spans):
+        starts.append(len(spans) - words)
+    return [text[spans[s][0]:spans[s + words - 1][1]] for s in starts]
+
+def split_docs(docs: Iterable[Dict], max_chars: int = 0, overlap: int = 0,
+               window_words: int = 0, stride_words: int = 0) -> Iterator[Dict]:
+    """Yield each doc as one or more passage docs. With window_words every
+    doc is windowed; otherwise only docs longer than max_chars are split.
+    Docs that end up as a single piece pass through unchanged."""
+    for doc in docs:
+        text = doc.get("text") or ""
+        if window_words:
+            pieces = window_text(text, window_words, stride_words)
+        elif max_chars and len(text) > max_chars:
+            pieces = split_text(text, max_chars, overlap)
+        else:
+            pieces = [text]
+        if len(pieces) <= 1:
+            yield doc
+            continue
+        for i, piece in enumerate(pieces):
+            yield {**doc, "docno": passage_docno(doc["path"], i), "text": piece}
+
+def aggregate(res: pd.DataFrame, k: int, how: str = "max") -> pd.DataFrame:
+    """Collapse passage hits to one hit per (qid, document), keep the top k
+    documents per query and re-rank.
+
+    max (MaxP): a document scores as its best retrieved passage.
+    first (FirstP): a document scores as its earliest retrieved passage. That
+    is usually %p0, but it can be a later passage when %p0 fell outside the
+    retrieval depth.
+
+    docno becomes the document's path. docid stays that of the chosen
+    passage, so stored fields (content) come from the matching passage.
+    """
+    if res.empty:
+        return res
+    if how not in AGGREGATIONS:
+        raise ValueError(f"Unknown passage aggregation: {how} (use one of {AGGREGATIONS})")
+    res = res.copy()
+    docnos = res["docno"].astype(str)
+    res["docno"] = docnos.str.replace(_PASSAGE_SUFFIX, "", regex=True)
+    if how == "max":
+        order, asc = ["qid", "score"], [True, False]
+    else:
+        res["_p"] = docnos.str.extract(r"%p(\d+)$", expand=False).fillna("0").astype(int)
+        order, asc = ["qid", "_p"], [True, True]
+    # one sort + drop_duplicates keeps each doc's winning passage; no per-group Python
+    res = res.sort_values(order, ascending=asc, kind="stable").drop_duplicates(["qid", "docno"])
+    if how == "first":
+        res = res.drop(columns="_p")
+    res = res.sort_values(["qid", "score"], ascending=[True, False], kind="stable")
+    res = res.groupby("qid", sort=False).head(k).copy()
+    res["rank"] = res.groupby("qid", sort=False).cumcount()
+    return res.reset_index(drop=True)
@@ -0,0 +1,180 @@
+"""BM25 scorers over the NumPy export: exhaustive, and safe dynamic pruning
+(MaxScore / block-max MaxScore).
+
+Both pruned processors return the same top-k as exhaustive BM25 (up to float ties).
+They only skip documents that provably cannot reach the current k-th score
+(theta):
+
+  1. theta starts as the k-th best exact score among the postings in the
+     top-scoring blocks of the strongest query term. These are real
+     documents, so theta is a valid lower bound.
+  2. maxscore: terms are sorted by upper bound. The longest prefix whose
+     bounds sum to less than theta is "non-essential": a document that only
+     contains those terms cannot make the top k. Candidates are therefore
+     the postings of the essential terms only. Non-essential terms are just
+     probed for those candidates with a binary search.
+  3. blockmax: as maxscore, but essential-term blocks whose block max plus
+     the other terms' bounds is below theta are never read. Each remaining
+     candidate is then bounded by the block maxima covering it, and only
+     candidates whose bound reaches theta are scored exactly.
+
+All steps are vectorized over NumPy arrays, and nothing runs per posting in
+Python. The exhaustive scorer is the reference: every posting of every query
+term, accumulated per document.
+"""
+from collections import Counter
+
+import numpy as np
+
+from src.npindex import NpIndex, bm25_tf, bm25_qtf
+
+PRUNING_MODES = ("maxscore", "blockmax")
+
+def query_terms(npx: NpIndex, terms: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Term ids of the query terms found in the lexicon, and their query-tf weights."""
+    qtf = Counter(terms)
+    ids = npx.term_ids(list(qtf))
+    found = ids >= 0
+    w = bm25_qtf(np.array([c for c, f in zip(qtf.values(), found) if f], dtype=float))
+    return ids[found], w
+
+def top_k(npx: NpIndex, cand: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """The k best live candidates, by score then docid."""
+    live = npx.live[cand]
+    cand, scores = cand[live], scores[live]
+    if len(cand) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        cut = scores[part].min()
+        keep = scores >= cut  # keep ties at the cut; lexsort picks by docid
+        cand, scores = cand[keep], scores[keep]
+    order = np.lexsort((cand, -scores))[:k]
+    return cand[order], scores[order]
+
+class ExhaustiveScorer:
+    """Term-at-a-time BM25 over every posting of the query terms. Short
+    queries sum per-candidate contributions with np.unique + bincount; once the
+    postings cover a large share of the collection, a dense accumulator over
+    all docids is cheaper."""
+
+    DENSE_FRACTION = 0.125
+
+    def __init__(self, npx: NpIndex):
+        self.npx = npx
+        self.last_stats: dict = {}
+
+    def search(self, terms: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        npx = self.npx
+        tids, w = query_terms(npx, terms)
+        docs, contrib = [], []
+        for t, wt in zip(tids, w):
+            d, tf = npx.postings(t)
+            docs.append(d)
+            contrib.append(wt * npx.idf[t] * bm25_tf(tf, npx.doclen[d], npx.avgdl, npx.k1, npx.b))
+        n = sum(len(d) for d in docs)
+        self.last_stats = {"terms": len(tids), "postings": n, "scored_docs": 0}
+        if not n:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        d, c = np.concatenate(docs), np.concatenate(contrib)
+        if n > self.DENSE_FRACTION * npx.n_docs:
+            acc = np.bincount(d, weights=c, minlength=npx.n_docs)
+            cand = np.flatnonzero(np.bincount(d, minlength=npx.n_docs))
+            scores = acc[cand]
+        else:
+            cand, inv = np.unique(d, return_inverse=True)
+            scores = np.bincount(inv, weights=c)
+        self.last_stats["scored_docs"] = int(len(cand))
+        return top_k(npx, cand.astype(np.int64), scores, k)
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenated aranges [starts[i], ends[i]) without a Python loop."""
+    lens = ends - starts
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(starts - np.concatenate([[0], np.cumsum(lens)[:-1]]), lens)
+    return np.arange(total, dtype=np.int64) + shift
+
+class PrunedScorer:
+    """Top-k BM25 for one query over an NpIndex. `last_stats` records the
+    query's total postings, how many terms stayed essential and how many
+    documents were scored exactly."""
+
+    def __init__(self, npx: NpIndex, mode: str = "blockmax"):
+        if mode not in PRUNING_MODES:
+            raise ValueError(f"Unknown pruning mode: {mode} (use one of {PRUNING_MODES})")
+        self.npx = npx
+        self.mode = mode
+        self.block = npx.meta["block"]
+        self.last_stats: dict = {}
+
+    def _score(self, cand: np.ndarray, tids: np.ndarray, w: np.ndarray) -> np.ndarray:
+        """Exact BM25 of candidate docids (sorted) over the query terms."""
+        npx = self.npx
+        scores = np.zeros(len(cand))
+        dl = npx.doclen[cand]
+        for t, wt in zip(tids, w):
+            d, tf = npx.postings(t)
+            pos = np.minimum(np.searchsorted(d, cand), len(d) - 1)
+            hit = d[pos] == cand
+            scores[hit] += wt * npx.idf[t] * bm25_tf(tf[pos[hit]], dl[hit], npx.avgdl, npx.k1, npx.b)
+        return scores
+
+    def _blocks(self, t: int, keep: np.ndarray) -> np.ndarray:
+        """Docids in term t's blocks selected by the bool mask keep."""
+        d = self.npx.postings(t)[0]
+        starts = np.flatnonzero(keep) * self.block
+        return d[_ranges(starts, np.minimum(starts + self.block, len(d)))]
+
+    def search(self, terms: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        npx = self.npx
+        tids, w = query_terms(npx, terms)
+        self.last_stats = {"terms": len(tids), "postings": int(npx.df[tids].sum()) if len(tids) else 0}
+        if not len(tids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        ub = np.maximum(w * npx.ub[tids], 0.0)
+        blk = [(int(npx.blk_ptr[t]), int(npx.blk_ptr[t + 1])) for t in tids]
+
+        # 1. theta from the strongest term's best blocks
+        s = int(np.argmax(ub))
+        b0, b1 = blk[s]
+        bm = npx.blk_max[b0:b1]
+        n_best = min(len(bm), max(1, -(-2 * k // self.block)))
+        best = np.zeros(len(bm), dtype=bool)
+        best[np.argpartition(-bm, n_best - 1)[:n_best]] = True
+        seed = np.unique(self._blocks(tids[s], best))
+        seed_scores = self._score(seed, tids, w)
+        live_seed = seed_scores[npx.live[seed]]
+        theta = np.partition(live_seed, len(live_seed) - k)[len(live_seed) - k] if len(live_seed) >= k else -np.inf
+        # bounds and exact scores are summed in different orders; never prune on rounding
+        theta -= 1e-9 * max(1.0, abs(theta)) if np.isfinite(theta) else 0.0
+
+        # 2. essential terms: all but the longest low-bound prefix summing below theta
+        order = np.argsort(ub)
+        essential = np.ones(len(tids), dtype=bool)
+        essential[order[np.cumsum(ub[order]) < theta]] = False
+        total_ub = ub.sum()
+
+        parts = [seed]
+        for i in np.flatnonzero(essential):
+            b0, b1 = blk[i]
+            if self.mode == "blockmax" and np.isfinite(theta):
+                keep = w[i] * npx.blk_max[b0:b1] + (total_ub - ub[i]) >= theta
+            else:
+                keep = np.ones(b1 - b0, dtype=bool)
+            parts.append(self._blocks(tids[i], keep))
+        cand = np.unique(np.concatenate(parts))
+
+        # 3. block-max bound per candidate; score only those that can reach theta
+        if self.mode == "blockmax" and np.isfinite(theta) and len(cand):
+            bound = np.zeros(len(cand))
+            for i, t in enumerate(tids):
+                b0, b1 = blk[i]
+                j = np.searchsorted(npx.blk_last[b0:b1], cand)
+                inside = j < (b1 - b0)
+                bound[inside] += np.maximum(w[i] * npx.blk_max[b0:b1][j[inside]], 0.0)
+            cand = cand[bound >= theta]
+
+        scores = self._score(cand, tids, w)
+        self.last_stats.update(essential=int(essential.sum()), theta=float(theta), scored_docs=int(len(cand)))
+        return top_k(npx, cand, scores, k)
@@ -0,0 +1,16 @@
+import re
+
+FIELDY = re.compile(r'\b(?:site|filetype|inurl|intitle|ext):\S+', re.IGNORECASE)
+ONLY_ALNUM = re.compile(r"[A-Za-z0-9]+")
+
+def canon_query(q: str) -> str:
+    # normalize for dedup (same string across rows -> same qid)
+    return " ".join((q or "").strip().split()).lower()
+
+def clean_query(q: str) -> str:
+    if not isinstance(q, str):
+        return ""
+    q = FIELDY.sub(" ", q)
+    q = q.replace('"', " ").replace("'", " ")
+    toks = ONLY_ALNUM.findall(q.lower())
+    return " ".join(toks).strip()
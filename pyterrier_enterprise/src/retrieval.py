@@ -0,0 +1,190 @@
+"""Open the index for querying, including shards and incremental delta indexes."""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+
+from src import incremental as inc
+from src.dedup import cluster_table
+from src.docstore import DocStore, STORED_FIELDS
+from src.passages import aggregate
+from src.snippets import open_stores, snippet_column
+
+def index_stamp(index_dir: str | Path) -> tuple:
+    """Cheap change detector: mtimes of the manifest and base properties file.
+    Every full build, delta build and compaction rewrites at least one of them."""
+    stamp = []
+    for name in (inc.MANIFEST_NAME, "data.properties"):
+        try:
+            stamp.append((Path(index_dir) / name).stat().st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+LOAD_MODES = {
+    "disk": False,
+    "fileinmem": ["lexicon", "inverted"],  # postings + lexicon in RAM, meta on disk
+    "memory": True,                        # every structure, including meta
+}
+
+def docstore_columns(docstores: list, offsets: np.ndarray, docids: np.ndarray,
+                     fields: list[str]) -> tuple[dict[str, list], dict[str, np.ndarray]]:
+    """Docstore fields for docids, decoded a block at a time per component.
+    Also returns, per field, a mask of rows still to be filled from elsewhere
+    (non-docstore fields, or components built without a docstore)."""
+    n = len(docids)
+    out = {f: [None] * n for f in fields}
+    need = {f: np.full(n, f not in STORED_FIELDS) for f in fields}
+    stored = [f for f in fields if f in STORED_FIELDS]
+    if n == 0 or not stored:
+        return out, need
+    comp = np.searchsorted(offsets, docids, side="right") - 1
+    local = docids - offsets[comp]
+    for c in np.unique(comp):
+        rows = np.flatnonzero(comp == c)
+        store = docstores[c]
+        if store is None:
+            for f in stored:
+                need[f][rows] = True
+            continue
+        recs = store.get_many(local[rows])
+        for f in stored:
+            col = out[f]
+            for r, rec in zip(rows, recs):
+                col[r] = rec.get(f) if rec else None
+    return out, need
+
+class IndexHandle:
+    """A (possibly multi-component) Terrier index plus the docs that must be hidden.
+
+    Components (base or shards, plus deltas) are combined with Terrier's
+    MultiIndex, which sums collection statistics across them, so BM25 scores
+    use corpus-wide N, avgdl and df and merge into a single top-k. Docids are offset per component in
+    order, which lets us tell which component a hit came from.
+    """
+
+    def __init__(self, index_dir: str | Path, memory: bool | list[str] = False):
+        index_dir = Path(index_dir)
+        if not index_dir.exists():
+            raise FileNotFoundError(f"Index not found: {index_dir}")
+        self.index_dir = index_dir
+        self.stamp = index_stamp(index_dir)
+        self.manifest = inc.load_manifest(index_dir)
+        self.version = self.manifest["version"] if self.manifest else 0
+
+        names = self.manifest["components"] if self.manifest else [inc.BASE]
+        # memory: False (read from disk), a list of structures, or True for all
+        parts = [pt.IndexFactory.of(str(inc.component_path(index_dir, n)), memory=memory) for n in names]
+        if len(parts) == 1:
+            self.index = parts[0]
+        else:
+            stats = parts[0].getCollectionStatistics()
+            MultiIndex = pt.java.autoclass("org.terrier.realtime.multi.MultiIndex")
+            self.index = MultiIndex(parts, False, stats.getNumberOfFields() > 0)
+
+        counts = [p.getCollectionStatistics().getNumberOfDocuments() for p in parts]
+        self.docstores = [DocStore.open(inc.component_path(index_dir, n)) for n in names]
+        self.snippet_stores = open_stores(inc.component_path(index_dir, n) for n in names)
+        self._stopwords = None
+        self._meta = self.index.getMetaIndex()
+        self.names = names
+        self.offsets = np.cumsum([0] + counts[:-1])
+        dead = (self.manifest or {}).get("dead", {})
+        self.dead = {n: set(dead.get(n, ())) for n in names}
+        self.n_dead = sum(len(v) for v in self.dead.values())
+        # any file split into passages means hits must be folded back into documents
+        self.passages = any("parts" in e for e in (self.manifest or {}).get("docs", {}).values())
+        # representative path -> duplicates left out of the index (src/dedup.py)
+        self.duplicates = cluster_table(self.manifest)
+
+    def fetch_fields(self, docids, fields: list[str]) -> dict[str, list]:
+        """Stored fields for many hits at once, as one column per field.
+
+        Docstore fields are decoded a block at a time per component. All other
+        fields, and docstore fields for components built without a docstore,
+        use one MetaIndex.getItems call per field instead of a call per hit.
+        """
+        docids = np.asarray(docids, dtype=np.int64)
+        out, need_meta = docstore_columns(self.docstores, self.offsets, docids, fields)
+        if not len(docids):
+            return out
+        for f in fields:
+            rows = np.flatnonzero(need_meta[f])
+            if not len(rows):
+                continue
+            try:
+                vals = self._meta.getItems(f, docids[rows].tolist())
+            except Exception:
+                continue
+            col = out[f]
+            for r, v in zip(rows, vals):
+                col[r] = v
+        return out
+
+    def snippets(self, docids, query: str, chars: int) -> list[str]:
+        """Query-biased snippets (src/snippets.py); "" where none were stored."""
+        from src.npsearch import TerrierTermPipeline, tokenise
+
+        if self._stopwords is None:
+            self._stopwords = TerrierTermPipeline("Stopwords")
+        terms = self._stopwords(tokenise(query))
+        return snippet_column(self.snippet_stores, self.offsets, docids, terms, chars)
+
+    def live_mask(self, res: pd.DataFrame) -> np.ndarray:
+        if not self.n_dead or res.empty:
+            return np.ones(len(res), dtype=bool)
+        comp = np.searchsorted(self.offsets, res["docid"].to_numpy(), side="right") - 1
+        docnos = res["docno"].to_numpy()
+        return np.array([d not in self.dead[self.names[c]] for c, d in zip(comp, docnos)], dtype=bool)
+
+    def drop_dead(self, res: pd.DataFrame) -> pd.DataFrame:
+        """Remove superseded/deleted hits and re-rank within each query."""
+        if not self.n_dead or res.empty:
+            return res
+        res = res[self.live_mask(res)].copy()
+        res["rank"] = res.groupby("qid").cumcount()
+        return res
+
+    def pruned_retriever(self, num_results: int, mode: str):
+        """BM25 via MaxScore/block-max pruning over the NumPy export (src/pruning.py)."""
+        from src.npindex import NpIndex
+        from src.npsearch import NpRetriever
+
+        npx = NpIndex.open(self.index_dir, self.stamp)
+        if npx is None:
+            raise RuntimeError(f"No up-to-date npindex under {self.index_dir}; "
+                               f"run `python -m src.5_export_index` (or drop --pruning)")
+        return NpRetriever(npx, num_results, mode,
+                           docnos=lambda docids: self.fetch_fields(docids, ["docno"])["docno"])
+
+    def retriever(self, wmodel: str = "BM25", k: int = 1000, threads: int = 1,
+                  agg: str = "max", passage_depth: int = 3, pruning: str | None = None):
+        """BM25 over all components, returning k live document hits per query
+        where possible. threads > 1 uses Terrier's multi-threaded batch retrieval.
+
+        If the index holds passages, k * passage_depth passages are retrieved
+        and folded into documents with MaxP (agg="max") or FirstP (agg="first").
+        docnos are then file paths, as in a document-level index.
+
+        pruning ("maxscore" or "blockmax") swaps Terrier's exhaustive DAAT for
+        the safe pruned scorer. It returns the same top-k and already skips
+        dead documents. BM25 only."""
+        depth = k * max(1, passage_depth) if self.passages else k
+        if pruning:
+            if wmodel != "BM25":
+                raise ValueError(f"Pruned retrieval supports BM25 only, not {wmodel}")
+            pipe = self.pruned_retriever(depth, pruning)
+            if not self.passages:
+                return pipe
+            return (pipe >> pt.apply.generic(lambda res: aggregate(res, k, agg))) % k
+        if not (self.n_dead or self.passages):
+            return pt.terrier.Retriever(self.index, wmodel=wmodel, num_results=k, threads=threads)
+        # over-fetch so that dropping dead hits still leaves k results
+        slack = min(self.n_dead, depth)
+        pipe = pt.terrier.Retriever(self.index, wmodel=wmodel, num_results=depth + slack, threads=threads)
+        if self.n_dead:
+            pipe = pipe >> pt.apply.generic(self.drop_dead)
+        if self.passages:
+            pipe = pipe >> pt.apply.generic(lambda res: aggregate(res, k, agg))
+        return pipe % k
@@ -0,0 +1,77 @@
+"""Reading qrels and writing run files, vectorized with pandas."""
+import csv
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TREC_CHUNK_ROWS = 200_000
+
+def read_qrels(qrels_path: Path) -> pd.DataFrame:
+    """Parse `qid iter docno label` lines; docno may contain spaces (Windows paths).
+
+    Lines are read whole by the C parser, then split column-wise: the first
+    two tokens from the left, the label from the right, and the docno is
+    whatever is in between."""
+    lines = pd.read_csv(
+        qrels_path, sep="\x1f", header=None, names=["line"], dtype=str,
+        quoting=csv.QUOTE_NONE, keep_default_na=False, skip_blank_lines=True,
+        encoding="utf-8", encoding_errors="replace", engine="c",
+    )["line"].str.strip()
+    head = lines.str.split(n=2, expand=True)
+    if head.shape[1] < 3:
+        raise RuntimeError(f"No qrels parsed from {qrels_path}")
+    tail = head[2].str.rsplit(n=1, expand=True)
+    if tail.shape[1] < 2:
+        raise RuntimeError(f"No qrels parsed from {qrels_path}")
+    df = pd.DataFrame({"qid": head[0], "docno": tail[0], "label": tail[1]})
+    ok = df["label"].str.fullmatch(r"-?\d+", na=False) & df["docno"].notna()
+    df = df[ok].copy()
+    if df.empty:
+        raise RuntimeError(f"No qrels parsed from {qrels_path}")
+    df["label"] = df["label"].astype(int)
+    df["qid"] = df["qid"].astype(str)
+    df["docno"] = df["docno"].astype(str).str.strip()
+    return df.reset_index(drop=True)
+
+def add_ranks(run_df: pd.DataFrame) -> pd.DataFrame:
+    """Sort by (qid, score desc) and number hits 1.. per qid, as TREC expects."""
+    missing = {"qid", "docno", "score"} - set(run_df.columns)
+    if missing:
+        raise RuntimeError(f"Retriever output missing columns: {missing}")
+    run_df = run_df.sort_values(["qid", "score"], ascending=[True, False]).copy()
+    run_df["rank"] = run_df.groupby("qid").cumcount() + 1  # 1-based for TREC
+    return run_df
+
+def write_trec(run_df: pd.DataFrame, out_path: Path, tag: str) -> None:
+    """Write `qid Q0 docno rank score tag` lines, built by column-wise string
+    concatenation a chunk at a time into a large write buffer."""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        for start in range(0, len(run_df), TREC_CHUNK_ROWS):
+            part = run_df.iloc[start:start + TREC_CHUNK_ROWS]
+            score = pd.Series(np.char.mod("%.6f", part["score"].to_numpy(dtype=float)), index=part.index)
+            lines = (part["qid"].astype(str) + " Q0 " + part["docno"].astype(str) + " "
+                     + part["rank"].astype(int).astype(str) + " " + score + " " + tag)
+            f.write("\n".join(lines))
+            f.write("\n")
+
+def write_parquet(run_df: pd.DataFrame, out_path: Path, tag: str) -> None:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    cols = run_df[["qid", "docno", "rank", "score"]].copy()
+    cols["qid"] = cols["qid"].astype(str)
+    cols["rank"] = cols["rank"].astype("int32")
+    cols["tag"] = tag
+    try:
+        cols.to_parquet(out_path, index=False)
+    except ImportError as e:
+        raise SystemExit(f"Parquet run output needs pyarrow (pip install pyarrow): {e}")
+
+def write_run(run_df: pd.DataFrame, out_path: Path, tag: str, fmt: str = "auto") -> None:
+    """fmt: trec, parquet, or auto (parquet if out_path ends in .parquet)."""
+    if fmt == "auto":
+        fmt = "parquet" if out_path.suffix.lower() == ".parquet" else "trec"
+    if fmt == "parquet":
+        write_parquet(run_df, out_path, tag)
+    else:
+        write_trec(run_df, out_path, tag)
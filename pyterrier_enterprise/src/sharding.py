@@ -0,0 +1,79 @@
+"""Sharded multi-process index builds.
+
+Files are partitioned by a stable hash of their path, and each shard is
+indexed in its own process with its own JVM and heap. The shards are listed
+as components in manifest.json, so retrieval.IndexHandle opens them as one
+MultiIndex with corpus-wide statistics. Duplicates (src/dedup.py) are found
+within each shard only.
+"""
+import multiprocessing as mp
+import shutil
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable
+
+from src import incremental as inc
+
+def shard_name(i: int) -> str:
+    return f"{inc.SHARD_PREFIX}{i:02d}"
+
+def shard_of(path: str, n_shards: int) -> int:
+    # crc32 is stable across processes/runs, unlike hash()
+    return zlib.crc32(path.encode("utf-8")) % n_shards
+
+def partition(files: Iterable[Path], n_shards: int) -> list[list[Path]]:
+    parts: list[list[Path]] = [[] for _ in range(n_shards)]
+    for fp in files:
+        parts[shard_of(str(fp), n_shards)].append(fp)
+    return parts
+
+def _index_shard(index_root: str, name: str, files: list[str]) -> tuple[str, dict, dict]:
+    # runs in a child process: own JVM, own heap
+    from src.indexing import init_java, index_docs, open_cache, close_cache, docs_for, make_deduper
+
+    init_java()
+    cache = open_cache()
+    shard_root = inc.component_path(Path(index_root), name)
+    shard_root.mkdir(parents=True, exist_ok=True)
+    part = inc.empty_manifest()
+    dedup = make_deduper()
+    print(f"[{name}] indexing {len(files)} files into: {shard_root}", flush=True)
+    index_docs(shard_root, inc.track(docs_for(map(Path, files), cache, dedup), part, name),
+               label=name, total=len(files))
+    if dedup is not None:
+        dedup.commit(part, shard_root)
+        print(f"[{name}] {dedup.summary()}", flush=True)
+    close_cache(cache)
+    print(f"[{name}] done ({len(part['docs'])} docs)", flush=True)
+    return name, part["docs"], part.get("skipped", {})
+
+def build_sharded(files: Iterable[Path], index_root: Path, n_shards: int, processes: int = 0) -> dict:
+    """Index files into n_shards shards in parallel; write and return the manifest."""
+    # empty shards (tiny corpora) are skipped; Terrier can't open an empty index
+    parts = [p for p in partition(files, n_shards) if p]
+    names = [shard_name(i) for i in range(len(parts))]
+    manifest = inc.empty_manifest()
+    manifest["components"] = names
+    manifest["shards"] = {n: {"files": len(p)} for n, p in zip(names, parts)}
+
+    # spawn: a forked child would inherit (and fight over) the parent's JVM
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes or n_shards, mp_context=ctx) as pool:
+        futs = [pool.submit(_index_shard, str(index_root), n, [str(f) for f in p])
+                for n, p in zip(names, parts)]
+        for fut in as_completed(futs):
+            name, docs, skipped = fut.result()
+            manifest["docs"].update(docs)
+            if skipped:
+                manifest.setdefault("skipped", {}).update(skipped)
+            manifest["shards"][name]["docs"] = len(docs)
+
+    # shards whose files were all skipped by dedup are empty too: drop them
+    for name in [n for n in names if not manifest["shards"][n]["docs"]]:
+        manifest["components"].remove(name)
+        del manifest["shards"][name]
+        shutil.rmtree(inc.component_path(index_root, name), ignore_errors=True)
+
+    inc.save_manifest(index_root, manifest)
+    return manifest
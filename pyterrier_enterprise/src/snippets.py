@@ -0,0 +1,145 @@
+"""Query-biased snippets from a small per-component store built at index time.
+
+For each document, index_docs writes the first SNIPPET_SCAN_CHARS characters
+of its text together with the start offsets of its sentences, in the
+docstore format under <component>/snippets. At query time, make_snippet()
+finds the query terms in that text with one regex pass. It maps the matches
+to sentences through the stored offsets and keeps the sentences that cover
+the most distinct query terms, most matches first, within `chars`
+characters. Query terms are wrapped in <b></b>, and the rest is HTML-escaped.
+
+Each hit therefore costs one block lookup plus a scan of at most
+SNIPPET_SCAN_CHARS characters, however long the document is. Matching is by
+word prefix (a query's "indexing" also matches "indexed"), which is close
+enough to stemming for highlighting.
+"""
+import html
+import re
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+
+from src.docstore import DocStore, DocStoreWriter
+
+SNIPPET_DIR = "snippets"
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n\s*")
+_SPACE = re.compile(r"\s+")
+_SUFFIXES = ("ing", "ed", "es", "ly", "s")
+MIN_PREFIX = 3
+
+def sentence_starts(text: str) -> list[int]:
+    """Offsets where sentences (or lines) start."""
+    return [0] + [m.end() for m in _SENTENCE.finditer(text) if m.end() < len(text)]
+
+def snippet_record(text: str, scan_chars: int) -> dict:
+    text = text[:scan_chars]
+    return {"text": text, "sent": sentence_starts(text)}
+
+class SnippetWriter:
+    """Writes each doc's snippet source, in docid order, as docs stream past."""
+
+    def __init__(self, index_dir: Path, scan_chars: int):
+        self.store = DocStoreWriter(index_dir, SNIPPET_DIR)
+        self.scan_chars = scan_chars
+
+    def wrap(self, docs: Iterable[Dict]) -> Iterator[Dict]:
+        for doc in docs:
+            self.store.add_record(snippet_record(doc.get("text") or "", self.scan_chars))
+            yield doc
+
+    def close(self) -> None:
+        self.store.close()
+
+def open_stores(component_dirs: Iterable[Path]) -> list[Optional[DocStore]]:
+    return [DocStore.open(d, name=SNIPPET_DIR) for d in component_dirs]
+
+def _prefix(term: str) -> str:
+    for suf in _SUFFIXES:
+        if term.endswith(suf) and len(term) - len(suf) >= MIN_PREFIX:
+            return term[:-len(suf)]
+    return term
+
+def term_pattern(terms: list[str]) -> Optional[re.Pattern]:
+    """One case-insensitive regex matching any query term as a word prefix."""
+    prefixes = sorted({_prefix(t.lower()) for t in terms if t}, key=len, reverse=True)
+    if not prefixes:
+        return None
+    return re.compile(r"\b(" + "|".join(map(re.escape, prefixes)) + r")\w*", re.IGNORECASE)
+
+def _clip(text: str, chars: int) -> str:
+    text = _SPACE.sub(" ", text).strip()
+    if len(text) <= chars:
+        return text
+    cut = text.rfind(" ", 0, chars)
+    return text[:cut if cut > chars // 2 else chars] + " …"
+
+def _highlight(text: str, pattern: re.Pattern) -> str:
+    out, pos = [], 0
+    for m in pattern.finditer(text):
+        out.append(html.escape(text[pos:m.start()]))
+        out.append(f"<b>{html.escape(m.group(0))}</b>")
+        pos = m.end()
+    out.append(html.escape(text[pos:]))
+    return "".join(out)
+
+def make_snippet(rec: Optional[dict], pattern: Optional[re.Pattern], chars: int) -> str:
+    if not rec:
+        return ""
+    text, starts = rec["text"], rec["sent"] or [0]
+    matches = list(pattern.finditer(text)) if pattern is not None else []
+    if not matches:
+        return html.escape(_clip(text, chars))
+
+    # per sentence: distinct query terms matched, then total matches
+    terms: dict[int, set] = {}
+    counts: dict[int, int] = {}
+    for m in matches:
+        i = bisect_right(starts, m.start()) - 1
+        terms.setdefault(i, set()).add(m.group(1).lower())
+        counts[i] = counts.get(i, 0) + 1
+    ranked = sorted(terms, key=lambda i: (-len(terms[i]), -counts[i], i))
+
+    bounds = starts + [len(text)]
+    chosen, covered, used = [], set(), 0
+    for i in ranked:
+        if chosen and (terms[i] <= covered or used >= chars):
+            continue
+        chosen.append(i)
+        covered |= terms[i]
+        used += bounds[i + 1] - bounds[i]
+    parts = []
+    budget = chars
+    for i in sorted(chosen):
+        if budget <= 0:
+            break
+        sent = _SPACE.sub(" ", text[bounds[i]:bounds[i + 1]]).strip()
+        first = pattern.search(sent)
+        # a long sentence is cut so that its first match stays in view
+        if len(sent) > budget and first is not None and first.start() > budget // 3:
+            start = sent.find(" ", first.start() - budget // 3)
+            sent = "… " + sent[start + 1:]
+        sent = _clip(sent, budget)
+        parts.append(sent)
+        budget -= len(sent)
+    return " … ".join(_highlight(p, pattern) for p in parts)
+
+def snippet_column(stores: list[Optional[DocStore]], offsets: np.ndarray, docids,
+                   terms: list[str], chars: int) -> list[str]:
+    """Snippets for many hits of one query, reading each store block once."""
+    docids = np.asarray(docids, dtype=np.int64)
+    out = [""] * len(docids)
+    if not len(docids):
+        return out
+    pattern = term_pattern(terms)
+    comp = np.searchsorted(offsets, docids, side="right") - 1
+    local = docids - offsets[comp]
+    for c in np.unique(comp):
+        store = stores[c]
+        if store is None:
+            continue
+        rows = np.flatnonzero(comp == c)
+        for r, rec in zip(rows, store.get_many(local[rows])):
+            out[r] = make_snippet(rec, pattern, chars)
+    return out